@@ -3,18 +3,29 @@ import re
 import os
 import time
 import logging
-from telethon import TelegramClient
+from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 from telethon.tl.custom import Message
+from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
 import httpx
-from typing import Dict, Tuple, List, Optional
-from flask import Flask
+from typing import Callable, Dict, Iterator, Tuple, List, Optional
+from flask import Flask, jsonify
 import threading
 import json
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 import random
-import requests
+import importlib.util
+import weakref
+import bisect
+import hashlib
+import multiprocessing
+import queue
+import itertools
+import contextvars
+import contextlib
+import copy
+import sqlite3
 # ----------------------------
 # Configuration and Logging
 # ----------------------------
@@ -40,6 +51,50 @@ API_HASH = os.getenv('API_HASH', '')
 BOT_USERNAME = os.getenv('BOT_USERNAME', '')
 SERVER_UR = f"{SERVER_URL}/getinfo"
 
+# ----------------------------
+# Shared HTTP Client Pool
+# ----------------------------
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+AI_HTTP_TIMEOUT = float(os.getenv('AI_HTTP_TIMEOUT', 30))
+SERVER_HTTP_TIMEOUT = float(os.getenv('SERVER_HTTP_TIMEOUT', 10))
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+# One pooled client per event loop (run_async_code may recreate the loop)
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled HTTP client for the running event loop."""
+    global _http_client, _http_client_loop
+
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(AI_HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        )
+        _http_client_loop = loop
+        logger.info(f"🌐 Created pooled HTTP client (http2={HTTP2_ENABLED})")
+    return _http_client
+
+async def close_http_client() -> None:
+    """Close the pooled HTTP client, releasing all keep-alive connections."""
+    global _http_client, _http_client_loop
+
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+        logger.info("🌐 Closed pooled HTTP client")
+    _http_client = None
+    _http_client_loop = None
+
 # ----------------------------
 # Client Management
 # ----------------------------
@@ -49,6 +104,41 @@ app = Flask(__name__)
 def home():
     return "Hello!"
 
+def process_metrics() -> Dict[str, any]:
+    """Metrics kept by this process (a worker's own when sharded)."""
+    return {
+        "ticks": tick_scheduler.snapshot(),
+        "telegram": {s.label: s.snapshot() for s in list(telegram_schedulers.values())},
+        "decisions": dict(decision_counters),
+        "providers": provider_router.snapshot(),
+        "decision_cache": dict(decision_cache.metrics, size=len(decision_cache.entries)),
+        "decision_batches": dict(decision_batcher.metrics),
+        "decision_log": dict(decision_log.metrics),
+        "stats_buffer": dict(stats_buffer.metrics),
+        "pet_state": dict(pet_state_store.metrics, cached=len(pet_state_store.cache))
+    }
+
+# Flat counters that can be summed over workers
+SUMMED_METRICS = ("decisions", "decision_cache", "decision_batches", "decision_log", "stats_buffer", "pet_state")
+
+@app.route('/metrics')
+def metrics():
+    if not shard_supervisor:
+        return jsonify({"active_tasks": len(active_tasks), "workers": None, **process_metrics()})
+
+    # The supervisor monitors no pets itself: report what the workers last sent
+    workers = shard_supervisor.snapshot()
+    totals = {section: defaultdict(int) for section in SUMMED_METRICS}
+    for worker in workers.values():
+        for section in SUMMED_METRICS:
+            for key, value in worker.get("metrics", {}).get(section, {}).items():
+                totals[section][key] += value
+    return jsonify({
+        "active_tasks": sum(worker.get("sessions", 0) for worker in workers.values()),
+        "workers": workers,
+        **{section: dict(counts) for section, counts in totals.items()}
+    })
+
 
 # ----------------------------
 # Rate Limiting Configuration
@@ -61,31 +151,87 @@ RATE_LIMITS = {
     "ollama": (30, 60)     # 30 requests per minute (local)
 }
 
-# Track request timestamps per user per provider
-request_history = defaultdict(lambda: defaultdict(list))
+# Per-provider quotas shared by every user (the API keys are global)
+GLOBAL_RATE_LIMITS = {
+    "chatgpt": (60, 60),
+    "gemini": (15, 60),
+    "mistral": (60, 60),
+    "huggingface": (30, 60),
+    "ollama": (120, 60)
+}
+RATE_LIMIT_MAX_USERS = int(os.getenv('RATE_LIMIT_MAX_USERS', 5000))
+
+class TokenBucket:
+    """Classic token bucket: `capacity` requests per `period` seconds, O(1) acquire."""
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
 
-async def rate_limit_delay(user_id: int, provider: str) -> None:
-    """Add delay if needed to comply with rate limits."""
-    if provider not in RATE_LIMITS:
-        return
+    def __init__(self, capacity: int, period: float):
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
 
-    max_requests, time_window = RATE_LIMITS[provider]
-    now = time.time()
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
 
-    # Remove old requests from history
-    user_history = request_history[user_id][provider]
-    user_history = [t for t in user_history if now - t < time_window]
-    request_history[user_id][provider] = user_history
+    def available(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
 
-    # If we've hit the limit, calculate delay needed
-    if len(user_history) >= max_requests:
-        oldest_request = user_history[0]
-        time_remaining = time_window - (now - oldest_request)
-        if time_remaining > 0:
-            await asyncio.sleep(time_remaining + 0.1)  # Small buffer
+    def consume(self) -> None:
+        self.tokens -= 1
 
-    # Record this request
-    request_history[user_id][provider].append(now)
+class RateLimiter:
+    """Per-user and global per-provider token buckets.
+
+    User buckets live in an LRU bounded by max_users, so churned users don't
+    accumulate; an evicted bucket simply starts full again.
+    """
+
+    def __init__(self, user_limits: Dict[str, Tuple[int, int]],
+                 global_limits: Dict[str, Tuple[int, int]], max_users: int = RATE_LIMIT_MAX_USERS):
+        self.user_limits = user_limits
+        self.global_limits = global_limits
+        self.max_users = max_users
+        self.global_buckets = {p: TokenBucket(*limit) for p, limit in global_limits.items()}
+        self.user_buckets: "OrderedDict[Tuple[int, str], TokenBucket]" = OrderedDict()
+
+    def _buckets(self, user_id: int, provider: str) -> List[TokenBucket]:
+        buckets = []
+        if provider in self.user_limits:
+            key = (user_id, provider)
+            bucket = self.user_buckets.get(key)
+            if bucket is None:
+                bucket = self.user_buckets[key] = TokenBucket(*self.user_limits[provider])
+                if len(self.user_buckets) > self.max_users:
+                    self.user_buckets.popitem(last=False)
+            else:
+                self.user_buckets.move_to_end(key)
+            buckets.append(bucket)
+        if provider in self.global_buckets:
+            buckets.append(self.global_buckets[provider])
+        return buckets
+
+    def share_global(self, workers: int) -> None:
+        """Keep only a 1/workers share of each global quota, for processes
+        that use the same API keys side by side."""
+        for provider, (capacity, period) in self.global_limits.items():
+            bucket = TokenBucket(max(1, capacity // workers), period)
+            bucket.rate = capacity / workers / period
+            self.global_buckets[provider] = bucket
+
+    def try_acquire(self, user_id: int, provider: str) -> bool:
+        """Take a token from every applicable bucket, or none if any is empty."""
+        now = time.monotonic()
+        buckets = self._buckets(user_id, provider)
+        if not all(bucket.available(now) for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.consume()
+        return True
+
+rate_limiter = RateLimiter(RATE_LIMITS, GLOBAL_RATE_LIMITS)
 
 # ----------------------------
 # AI Decision Making System with Multi-Provider Fallback
@@ -97,6 +243,7 @@ OPENAI_API_KEY = os.getenv('OPEN_AI', '')          # Leave empty if not using
 HF_API_KEY = "your_huggingface_key_here"               # Leave empty if not using
 
 AI_PROVIDERS = [
+    "local",
     "chatgpt",
     "gemini",
     "mistral",
@@ -104,9 +251,164 @@ AI_PROVIDERS = [
     "ollama"
 ]
 
-async def get_ai_decision(stats: Dict[str, any], user_id: int) -> Dict[str, any]:
-    """Use AI to make intelligent decisions about pet care with multiple fallback providers."""
-    pet_care_context = """
+# ----------------------------
+# Decision Cache
+# ----------------------------
+DECISION_CACHE_BUCKET = int(os.getenv('DECISION_CACHE_BUCKET', 10))
+DECISION_CACHE_TTL = float(os.getenv('DECISION_CACHE_TTL', 300))
+DECISION_CACHE_SIZE = int(os.getenv('DECISION_CACHE_SIZE', 1024))
+
+class DecisionCache:
+    """LRU/TTL cache of AI decisions keyed on bucketed pet stats, shared by all users."""
+
+    def __init__(self, bucket: int = DECISION_CACHE_BUCKET, ttl: float = DECISION_CACHE_TTL,
+                 max_size: int = DECISION_CACHE_SIZE):
+        self.bucket = max(1, bucket)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: "OrderedDict[tuple, Tuple[float, Dict[str, any]]]" = OrderedDict()
+        self.metrics = defaultdict(int)
+
+    def key(self, stats: Dict[str, any]) -> tuple:
+        """Quantize stats so nearly identical states share a cache entry."""
+        b = self.bucket
+        return (
+            stats['energy'] // b, stats['clean'] // b, stats['health'] // b,
+            stats['hunger'] // b, stats['happiness'] // b, bool(stats['is_sleeping'])
+        )
+
+    def get(self, stats: Dict[str, any]) -> Optional[Dict[str, any]]:
+        key = self.key(stats)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.metrics['misses'] += 1
+            return None
+
+        stored_at, decision = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.entries[key]
+            self.metrics['expired'] += 1
+            self.metrics['misses'] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.metrics['hits'] += 1
+        return dict(decision)
+
+    def put(self, stats: Dict[str, any], decision: Dict[str, any]) -> None:
+        if decision.get('action') not in AI_ACTIONS:
+            return  # never serve a malformed answer to other users
+        key = self.key(stats)
+        self.entries[key] = (time.monotonic(), dict(decision))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.metrics['evictions'] += 1
+
+decision_cache = DecisionCache()
+
+# ----------------------------
+# Decision Log
+# ----------------------------
+DECISION_LOG_PATH = os.getenv('DECISION_LOG_PATH', '')  # e.g. decisions.jsonl; empty disables
+DECISION_LOG_MAX_BYTES = int(os.getenv('DECISION_LOG_MAX_BYTES', 50 * 1024 * 1024))
+DECISION_LOG_BACKUPS = int(os.getenv('DECISION_LOG_BACKUPS', 5))
+DECISION_LOG_BATCH = 500
+
+class DecisionLog:
+    """Append-only JSON Lines log of decisions (stats, decision, source, latency)
+    and action outcomes. Records are serialized on the caller and written by a
+    background thread, so the event loop never blocks on disk.
+
+    Past DECISION_LOG_MAX_BYTES the file is rotated to PATH.1 ... PATH.N
+    (N = DECISION_LOG_BACKUPS, oldest dropped), like logging's RotatingFileHandler.
+    """
+
+    def __init__(self, path: Optional[str] = DECISION_LOG_PATH):
+        self.path = path
+        self.queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+        self.writer: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.metrics = defaultdict(int)
+
+    def record(self, kind: str, **fields) -> None:
+        if not self.path:
+            return
+        self.queue.put(json.dumps(dict(kind=kind, ts=round(time.time(), 3), **fields), separators=(',', ':')))
+        self.metrics[kind] += 1
+        if self.writer is None:
+            with self.lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._run, name="decision-log", daemon=True)
+                    self.writer.start()
+
+    def _rotate(self) -> None:
+        for index in range(DECISION_LOG_BACKUPS - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if DECISION_LOG_BACKUPS > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.metrics["rotations"] += 1
+
+    def _run(self) -> None:
+        f = None
+        try:
+            f = open(self.path, 'a', encoding='utf-8')
+            while True:
+                lines = [self.queue.get()]
+                while len(lines) < DECISION_LOG_BATCH:
+                    try:
+                        lines.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                done = None in lines
+                lines = [line for line in lines if line is not None]
+                if lines:
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+                    if DECISION_LOG_MAX_BYTES and f.tell() >= DECISION_LOG_MAX_BYTES:
+                        f.close()
+                        self._rotate()
+                        f = open(self.path, 'a', encoding='utf-8')
+                if done:
+                    return
+        except OSError as e:
+            self.metrics["errors"] += 1
+            logger.error(f"⚠️ Decision log disabled: {e}")
+            self.path = None
+        finally:
+            if f:
+                f.close()
+
+    def close(self, timeout: float = 5) -> None:
+        """Flush pending records and stop the writer."""
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer:
+            self.queue.put(None)
+            writer.join(timeout)
+
+decision_log = DecisionLog()
+
+# Raw bot messages as BotMessageStream receives them, recorded the same way;
+# bench_stats.py replays them (empty disables)
+BOT_MESSAGE_CAPTURE_PATH = os.getenv('BOT_MESSAGE_CAPTURE_PATH', '')
+message_capture = DecisionLog(BOT_MESSAGE_CAPTURE_PATH)
+
+# ----------------------------
+# Decision Prompts
+# ----------------------------
+AI_PROMPT_MODE = os.getenv('AI_PROMPT_MODE', 'compact').lower()  # 'compact' or 'full'
+
+# A prompt is (system, user): the rules are built once and sent as the system
+# prompt, the per-tick part is just the stats. The compact system prompt (~250
+# tokens) is below the 1024-token minimum for OpenAI/Anthropic prompt caching,
+# so the saving comes from sending fewer tokens, not from provider caching.
+AIPrompt = Tuple[str, str]
+
+FULL_PROMPT_TEMPLATE = """
     Read instructions first You have been warned
     You are an AI pet caretaker. Based on the pet's current stats and available information, decide what action to take.
     use your sense take care like human being don't make one thing a major action 
@@ -171,49 +473,187 @@ async def get_ai_decision(stats: Dict[str, any], user_id: int) -> Dict[str, any]
     }}
     """
 
-    prompt = pet_care_context.format(
-        energy=stats['energy'],
-        clean=stats['clean'],
-        health=stats['health'],
-        hunger=stats['hunger'],
-        happiness=stats['happiness'],
-        is_sleeping=stats['is_sleeping']
-    )
+COMPACT_SYSTEM_PROMPT = (
+    "You are a virtual pet caretaker. Each message is the pet's stats as JSON "
+    "(percent values; sleeping=true means the pet is asleep). Pick one action.\n"
+    "feed: hunger +15, health +5, happiness +5. Not if hunger > 50 (pet is full). Needs health > 25.\n"
+    "bathe: clean to 100, happiness +2. Needs hunger, happiness and health not too low.\n"
+    "sleep: restores energy, blocks other actions. Needed when energy < 20; let it sleep until energy > 40. "
+    "If already sleeping use wait instead.\n"
+    "wake: wake a sleeping pet once energy is good; energy > 60 means it should be awake.\n"
+    "play: happiness +8, XP; health -5, energy -8, clean -4, hunger -7. Needs energy > 20; "
+    "good when energy > 50 and other stats are fine.\n"
+    "emergency: restores health; required when health < 25.\n"
+    "wait: nothing needed.\n"
+    "Balance care like a human would; don't overdo one action.\n"
+    'Reply with only this JSON: {"action": "action_name", "priority": "high/medium/low", "reasoning": "brief reason"}'
+)
 
-    # Try each provider in order until we get a successful response
-    for provider in AI_PROVIDERS:
-        try:
-            # Add rate limiting delay
-            await rate_limit_delay(user_id, provider)
-
-            if provider == "chatgpt":
-                decision = await _call_chatgpt(prompt, user_id)
-            elif provider == "gemini":
-                decision = await _call_gemini(prompt, user_id)
-            elif provider == "mistral":
-                decision = await _call_mistral(prompt, user_id)
-            elif provider == "huggingface":
-                decision = await _call_huggingface(prompt, user_id)
-            elif provider == "ollama":
-                decision = await _call_ollama(prompt, user_id)
+AI_ACTIONS = ("feed", "bathe", "sleep", "wake", "play", "emergency", "wait")
 
-            if decision:
-                logger.info(f"Used {provider} for user {user_id}")
-                return decision
+BATCH_SYSTEM_PROMPT = COMPACT_SYSTEM_PROMPT + (
+    "\nThis message holds several pets as a JSON array; each has an \"id\". Decide for every pet and "
+    'reply with only {"decisions": [{"id": id, "action": "action_name", "priority": "high/medium/low", '
+    '"reasoning": "brief reason"}, ...]}'
+)
 
-        except Exception as e:
-            logger.warning(f"Provider {provider} failed: {str(e)}")
-            continue
+def _stats_payload(stats: "PetStats") -> Dict[str, any]:
+    payload = {key: stats[key] for key in ('energy', 'clean', 'health', 'hunger', 'happiness')}
+    payload['sleeping'] = stats['is_sleeping']
+    return payload
+
+def build_prompt(stats: "PetStats", mode: Optional[str] = None) -> AIPrompt:
+    """Prompt for one decision: a cached system prompt plus a minimal stats payload
+    in compact mode, or the original long prompt as a single user message."""
+    if (mode or AI_PROMPT_MODE) == 'full':
+        return "", FULL_PROMPT_TEMPLATE.format(
+            energy=stats['energy'],
+            clean=stats['clean'],
+            health=stats['health'],
+            hunger=stats['hunger'],
+            happiness=stats['happiness'],
+            is_sleeping=stats['is_sleeping']
+        )
+    return COMPACT_SYSTEM_PROMPT, json.dumps(_stats_payload(stats), separators=(',', ':'))
+
+def build_batch_prompt(states: List["PetStats"]) -> AIPrompt:
+    """One prompt deciding for several pets; ids are positions in `states`."""
+    pets = [dict(_stats_payload(stats), id=index) for index, stats in enumerate(states)]
+    return BATCH_SYSTEM_PROMPT, json.dumps(pets, separators=(',', ':'))
+
+def is_batch_prompt(prompt: AIPrompt) -> bool:
+    return prompt[0] == BATCH_SYSTEM_PROMPT
+
+def _chat_messages(prompt: AIPrompt) -> List[Dict[str, str]]:
+    """OpenAI-style messages with the stable system prompt first."""
+    system, user = prompt
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": user})
+    return messages
+
+def _flat_prompt(prompt: AIPrompt) -> str:
+    system, user = prompt
+    return f"{system}\n\n{user}" if system else user
+
+async def get_ai_decision(stats: "PetStats", user_id: int) -> Dict[str, any]:
+    """Use AI to make intelligent decisions about pet care with multiple fallback providers."""
+    started = time.perf_counter()
+    source, decision = await _decide(stats, user_id)
+    decision_log.record("decision", user_id=user_id, stats=stats.to_dict(),
+                        decision={k: decision.get(k) for k in ("action", "priority", "reasoning")},
+                        source=source, latency_ms=round((time.perf_counter() - started) * 1000, 2))
+    return dict(decision, source=source)
+
+async def _decide(stats: "PetStats", user_id: int) -> Tuple[str, Dict[str, any]]:
+    """The decision for these stats and where it came from (rules, cache, ai:<provider>, fallback)."""
+    # Clear-cut states never need a provider round trip
+    decision = get_rule_decision(stats)
+    if decision:
+        logger.info(f"Rule '{decision['rule']}' decided for user {user_id}")
+        return "rules", decision
+
+    # Nearly identical states were already answered by a provider
+    decision = decision_cache.get(stats)
+    if decision:
+        logger.info(f"Cached decision for user {user_id}")
+        decision_counters['cache'] += 1
+        return "cache", decision
+
+    # Share one provider call with other pets deciding at the same time
+    if AI_BATCH_ENABLED and len(active_tasks) > 1:
+        provider, decision = await decision_batcher.decide(stats, user_id)
+    else:
+        provider, decision = await _request_decision(build_prompt(stats), user_id)
+
+    if decision:
+        logger.info(f"Used {provider} for user {user_id}")
+        decision_counters[f"ai:{provider}"] += 1
+        # The local model is cheaper than a cache lookup; caching it would also
+        # displace real provider answers
+        if provider != "local":
+            decision_cache.put(stats, decision)
+        return f"ai:{provider}", decision
 
     # If all providers fail, use fallback
     logger.error("All AI providers failed, using fallback decision")
-    return get_fallback_decision(stats)
+    return "fallback", get_fallback_decision(stats)
 
 # [Rest of your existing functions]
 
 # --- Provider Specific Implementations ---
 
-async def _call_chatgpt(prompt: str, user_id: int) -> Optional[Dict[str, any]]:
+class ProviderRateLimitError(Exception):
+    """Raised when a provider answers 429 Too Many Requests."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} rate limited for {retry_after:.0f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+class ProviderAbstained(Exception):
+    """Raised by a provider that declines to answer (not a failure)."""
+
+def _raise_for_rate_limit(provider: str, response: httpx.Response) -> None:
+    """Turn a 429 response into ProviderRateLimitError (honouring Retry-After)."""
+    if response.status_code != 429:
+        return
+    try:
+        retry_after = float(response.headers.get("retry-after", 60))
+    except ValueError:
+        retry_after = 60.0
+    raise ProviderRateLimitError(provider, retry_after)
+
+# --- Streaming ---
+
+AI_STREAMING = os.getenv('AI_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+DECISION_PRIORITIES = ("high", "medium", "low")
+ACTION_FIELD_RE = re.compile(r'"action"\s*:\s*"([A-Za-z]+)"')
+PRIORITY_FIELD_RE = re.compile(r'"priority"\s*:\s*"([A-Za-z]+)"')
+
+def early_decision(text: str, require_priority: bool = True) -> Optional[Dict[str, any]]:
+    """Decision from a partial JSON reply once its action (and priority) fields are complete."""
+    action = ACTION_FIELD_RE.search(text)
+    priority = PRIORITY_FIELD_RE.search(text)
+    if not action or (require_priority and not priority):
+        return None
+    return validate_decision({
+        "action": action.group(1),
+        "priority": priority.group(1) if priority else "medium",
+        "reasoning": "Streamed decision (returned before reasoning)"
+    })
+
+def _openai_delta(chunk: Dict[str, any]) -> str:
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+async def _stream_decision(provider: str, url: str, data: Dict[str, any], prompt: AIPrompt,
+                           chunk_text: Callable[[Dict[str, any]], str],
+                           headers: Optional[Dict[str, str]] = None) -> Optional[Dict[str, any]]:
+    """POST a streaming completion (SSE or NDJSON) and return as soon as the
+    action is known; batched prompts are read to the end."""
+    early = not is_batch_prompt(prompt)
+    text = ""
+    client = get_http_client()
+    async with client.stream("POST", url, headers=headers, json=data, timeout=AI_HTTP_TIMEOUT) as response:
+        _raise_for_rate_limit(provider, response)
+        if response.status_code != 200:
+            return None
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                line = line[5:].strip()
+            if not line or line == "[DONE]":
+                continue
+            try:
+                text += chunk_text(json.loads(line))
+            except (ValueError, AttributeError):
+                continue
+            if early:
+                decision = early_decision(text)
+                if decision:
+                    return decision  # closing the stream cancels the rest of the generation
+    return _parse_ai_response(text, expect_batch=not early)
+
+async def _call_chatgpt(prompt: AIPrompt, user_id: int) -> Optional[Dict[str, any]]:
     """Call OpenAI ChatGPT API"""
     headers = {
         "Content-Type": "application/json",
@@ -222,21 +662,23 @@ async def _call_chatgpt(prompt: str, user_id: int) -> Optional[Dict[str, any]]:
 
     data = {
         "model": "gpt-3.5-turbo",  # or "gpt-4" if you have access
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
+        "messages": _chat_messages(prompt),
         "response_format": { "type": "json_object" }  # request JSON response
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        url = "https://api.openai.com/v1/chat/completions"
-        response = await client.post(url, headers=headers, json=data)
-        if response.status_code == 200:
-            result = response.json()
-            return _parse_ai_response(result["choices"][0]["message"]["content"])
+    url = "https://api.openai.com/v1/chat/completions"
+    if AI_STREAMING:
+        return await _stream_decision("chatgpt", url, dict(data, stream=True), prompt, _openai_delta, headers)
+
+    client = get_http_client()
+    response = await client.post(url, headers=headers, json=data, timeout=AI_HTTP_TIMEOUT)
+    _raise_for_rate_limit("chatgpt", response)
+    if response.status_code == 200:
+        result = response.json()
+        return _parse_ai_response(result["choices"][0]["message"]["content"], is_batch_prompt(prompt))
     return None
 
-async def _call_anthropic(prompt: str, user_id: int) -> Optional[Dict[str, any]]:
+async def _call_anthropic(prompt: AIPrompt, user_id: int) -> Optional[Dict[str, any]]:
     """Call Anthropic's Claude API"""
     headers = {
         "Content-Type": "application/json",
@@ -244,20 +686,24 @@ async def _call_anthropic(prompt: str, user_id: int) -> Optional[Dict[str, any]]
         "anthropic-version": "2023-06-01"
     }
 
+    system, user = prompt
     data = {
         "model": "claude-3-sonnet-20240229",
         "max_tokens": 300,
-        "messages": [{"role": "user", "content": prompt}]
+        "messages": [{"role": "user", "content": user}]
     }
-
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post("https://api.anthropic.com/v1/messages", headers=headers, json=data)
-        if response.status_code == 200:
-            result = response.json()
-            return _parse_ai_response(result["content"][0]["text"])
+    if system:
+        data["system"] = system
+
+    client = get_http_client()
+    response = await client.post("https://api.anthropic.com/v1/messages", headers=headers, json=data, timeout=AI_HTTP_TIMEOUT)
+    _raise_for_rate_limit("anthropic", response)
+    if response.status_code == 200:
+        result = response.json()
+        return _parse_ai_response(result["content"][0]["text"], is_batch_prompt(prompt))
     return None
 
-async def _call_mistral(prompt: str, user_id: int) -> Optional[Dict[str, any]]:
+async def _call_mistral(prompt: AIPrompt, user_id: int) -> Optional[Dict[str, any]]:
     """Call Mistral API"""
     headers = {
         "Content-Type": "application/json",
@@ -266,41 +712,50 @@ async def _call_mistral(prompt: str, user_id: int) -> Optional[Dict[str, any]]:
 
     data = {
         "model": "mistral-small",
-        "messages": [{"role": "user", "content": prompt}],
+        "messages": _chat_messages(prompt),
         "response_format": {"type": "json_object"}
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post("https://api.mistral.ai/v1/chat/completions", headers=headers, json=data)
-        if response.status_code == 200:
-            result = response.json()
-            return _parse_ai_response(result["choices"][0]["message"]["content"])
+    url = "https://api.mistral.ai/v1/chat/completions"
+    if AI_STREAMING:
+        return await _stream_decision("mistral", url, dict(data, stream=True), prompt, _openai_delta, headers)
+
+    client = get_http_client()
+    response = await client.post(url, headers=headers, json=data, timeout=AI_HTTP_TIMEOUT)
+    _raise_for_rate_limit("mistral", response)
+    if response.status_code == 200:
+        result = response.json()
+        return _parse_ai_response(result["choices"][0]["message"]["content"], is_batch_prompt(prompt))
     return None
 
-async def _call_gemini(prompt: str, user_id: int) -> Optional[Dict[str, any]]:
+async def _call_gemini(prompt: AIPrompt, user_id: int) -> Optional[Dict[str, any]]:
     """Call Google Gemini API"""
     headers = {
         "Content-Type": "application/json"
     }
 
+    system, user = prompt
     data = {
         "contents": [{
-            "parts": [{"text": prompt}]
+            "parts": [{"text": user}]
         }],
         "generationConfig": {
             "response_mime_type": "application/json"
         }
     }
-
-    async with httpx.AsyncClient(timeout=30) as client:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
-        response = await client.post(url, headers=headers, json=data)
-        if response.status_code == 200:
-            result = response.json()
-            return _parse_ai_response(result["candidates"][0]["content"]["parts"][0]["text"])
+    if system:
+        data["systemInstruction"] = {"parts": [{"text": system}]}
+
+    client = get_http_client()
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+    response = await client.post(url, headers=headers, json=data, timeout=AI_HTTP_TIMEOUT)
+    _raise_for_rate_limit("gemini", response)
+    if response.status_code == 200:
+        result = response.json()
+        return _parse_ai_response(result["candidates"][0]["content"]["parts"][0]["text"], is_batch_prompt(prompt))
     return None
 
-async def _call_huggingface(prompt: str, user_id: int) -> Optional[Dict[str, any]]:
+async def _call_huggingface(prompt: AIPrompt, user_id: int) -> Optional[Dict[str, any]]:
     """Call HuggingFace Inference API"""
     headers = {
         "Authorization": f"Bearer {HF_API_KEY}",
@@ -308,68 +763,556 @@ async def _call_huggingface(prompt: str, user_id: int) -> Optional[Dict[str, any
     }
 
     data = {
-        "inputs": prompt,
+        "inputs": _flat_prompt(prompt),
         "parameters": {
             "return_full_text": False,
             "max_new_tokens": 300
         }
     }
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post(
-            "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.1",
-            headers=headers,
-            json=data
-        )
-        if response.status_code == 200:
-            result = response.json()
-            return _parse_ai_response(result[0]["generated_text"])
+    client = get_http_client()
+    response = await client.post(
+        "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.1",
+        headers=headers,
+        json=data,
+        timeout=AI_HTTP_TIMEOUT
+    )
+    _raise_for_rate_limit("huggingface", response)
+    if response.status_code == 200:
+        result = response.json()
+        return _parse_ai_response(result[0]["generated_text"], is_batch_prompt(prompt))
     return None
 
-async def _call_ollama(prompt: str, user_id: int) -> Optional[Dict[str, any]]:
+async def _call_ollama(prompt: AIPrompt, user_id: int) -> Optional[Dict[str, any]]:
     """Call local Ollama API"""
+    system, user = prompt
     data = {
         "model": "mistral",
-        "prompt": prompt,
+        "prompt": user,
         "format": "json",
-        "stream": False
+        "stream": AI_STREAMING,
+        "keep_alive": "30m"  # keep the model loaded between ticks
     }
-
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post("http://localhost:11434/api/generate", json=data)
-        if response.status_code == 200:
-            result = response.json()
-            return _parse_ai_response(result["response"])
+    if system:
+        data["system"] = system
+
+    url = "http://localhost:11434/api/generate"
+    if AI_STREAMING:
+        return await _stream_decision("ollama", url, data, prompt, lambda chunk: chunk.get("response", ""))
+
+    client = get_http_client()
+    response = await client.post(url, json=data, timeout=AI_HTTP_TIMEOUT)
+    _raise_for_rate_limit("ollama", response)
+    if response.status_code == 200:
+        result = response.json()
+        return _parse_ai_response(result["response"], is_batch_prompt(prompt))
     return None
 
-def _parse_ai_response(response_text: str) -> Dict[str, any]:
-    """Parse AI response from any provider into standard format"""
+# --- Local Decision Model ---
+
+LOCAL_MODEL_PATH = os.getenv('LOCAL_MODEL_PATH', 'decision_model.json')
+LOCAL_MODEL_MIN_CONFIDENCE = float(os.getenv('LOCAL_MODEL_MIN_CONFIDENCE', 0.75))
+
+class LocalDecisionModel:
+    """Small decision tree trained offline (train_decision_model.py) from logged
+    AI decisions. Reloaded whenever the model file changes on disk.
+
+    Nodes are {"feature", "threshold", "left", "right"} (left: value <= threshold)
+    or leaves {"action", "priority", "confidence", "samples"}.
+    """
+
+    def __init__(self, path: str = LOCAL_MODEL_PATH):
+        self.path = path
+        self.tree: Optional[Dict[str, any]] = None
+        self.mtime: Optional[float] = None
+
+    def load(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self.tree = self.mtime = None
+            return False
+        if mtime != self.mtime:
+            self.mtime = mtime
+            try:
+                with open(self.path) as f:
+                    self.tree = json.load(f)["tree"]
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Unreadable or half-written: no model until the file changes again
+                logger.warning(f"⚠️ Ignoring local decision model {self.path}: {e}")
+                self.tree = None
+                return False
+            logger.info(f"🌳 Loaded local decision model from {self.path}")
+        return self.tree is not None
+
+    def predict(self, features: Dict[str, any]) -> Optional[Dict[str, any]]:
+        """The leaf for these features (compact prompt payload), or None without a model."""
+        if not self.load():
+            return None
+        node = self.tree
+        while "action" not in node:
+            node = node["left"] if float(features[node["feature"]]) <= node["threshold"] else node["right"]
+        return node
+
+local_model = LocalDecisionModel()
+
+def _local_decision(features: Dict[str, any]) -> Optional[Dict[str, any]]:
+    leaf = local_model.predict(features)
+    if not leaf or leaf["confidence"] < LOCAL_MODEL_MIN_CONFIDENCE:
+        return None
+    return {
+        "action": leaf["action"],
+        "reasoning": f"Local model: {leaf['confidence']:.0%} of {leaf['samples']} similar logged states",
+        "priority": leaf["priority"]
+    }
+
+async def _call_local(prompt: AIPrompt, user_id: int) -> Optional[Dict[str, any]]:
+    """Answer in-process from the local model; abstain when it isn't confident."""
     try:
-        # First try to parse as pure JSON
-        response_json = json.loads(response_text)
-        if all(key in response_json for key in ["action", "reasoning", "priority"]):
-            return response_json
-    except json.JSONDecodeError:
-        pass
+        payload = json.loads(prompt[1])
+    except ValueError:
+        raise ProviderAbstained("local model needs the compact prompt") from None
+
+    if isinstance(payload, list):
+        # All or nothing: a partial answer would win the race and leave the
+        # rest of the batch to be retried without the remote providers
+        decisions = []
+        for pet in payload:
+            decision = _local_decision(pet)
+            if not decision:
+                raise ProviderAbstained("local model not confident for every pet")
+            decisions.append(dict(decision, id=pet["id"]))
+        return {"decisions": decisions}
+
+    decision = _local_decision(payload)
+    if not decision:
+        raise ProviderAbstained("local model not confident")
+    return decision
+
+# --- Provider Dispatch and Hedging ---
+
+PROVIDER_CALLS = {
+    "local": _call_local,
+    "chatgpt": _call_chatgpt,
+    "gemini": _call_gemini,
+    "mistral": _call_mistral,
+    "huggingface": _call_huggingface,
+    "ollama": _call_ollama
+}
 
-    # Fallback parsing for non-JSON responses
-    response_lower = response_text.lower()
-    actions = ["feed", "bathe", "sleep", "wake", "play", "emergency", "wait"]
-    detected_action = "wait"
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+AI_HEDGE_PERCENTILE = float(os.getenv('AI_HEDGE_PERCENTILE', 0.9))
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', 3.0))
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', 0.5))
 
-    for action in actions:
-        if action in response_lower:
-            detected_action = action
-            break
+# ----------------------------
+# Provider Router
+# ----------------------------
+ROUTER_FAILURE_THRESHOLD = int(os.getenv('ROUTER_FAILURE_THRESHOLD', 3))
+ROUTER_OPEN_SECONDS = float(os.getenv('ROUTER_OPEN_SECONDS', 60))
+ROUTER_MAX_OPEN_SECONDS = float(os.getenv('ROUTER_MAX_OPEN_SECONDS', 900))
+ROUTER_WINDOW_SECONDS = float(os.getenv('ROUTER_WINDOW_SECONDS', 300))
+
+PROVIDER_KEYS = {
+    "chatgpt": OPENAI_API_KEY,
+    "gemini": GEMINI_API_KEY,
+    "mistral": MISTRAL_API_KEY,
+    "huggingface": HF_API_KEY,
+    "anthropic": ANTHROPIC_API_KEY
+}
 
+def is_provider_configured(provider: str) -> bool:
+    """False for providers whose API key is empty or still a placeholder."""
+    if provider == "local":
+        return os.path.exists(LOCAL_MODEL_PATH)
+    if provider not in PROVIDER_KEYS:
+        return True  # keyless (e.g. local ollama)
+    key = PROVIDER_KEYS[provider]
+    return bool(key) and not key.startswith("your_")
+
+class ProviderHealth:
+    """Rolling latency/error state and circuit breaker for one provider."""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=50)   # recent successful call latencies (s)
+        self.outcomes = deque(maxlen=20)    # (timestamp, succeeded)
+        self.state = "closed"               # closed | open | half_open
+        self.consecutive_failures = 0
+        self.open_seconds = ROUTER_OPEN_SECONDS
+        self.open_until = 0.0
+        self.rate_limited_until = 0.0
+        self.probing = False
+
+    @property
+    def error_rate(self) -> float:
+        """Failure share over the rolling window, so old failures stop counting."""
+        cutoff = time.monotonic() - ROUTER_WINDOW_SECONDS
+        recent = [ok for at, ok in self.outcomes if at >= cutoff]
+        if not recent:
+            return 0.0
+        return recent.count(False) / len(recent)
+
+    def expected_latency(self) -> float:
+        """Median latency inflated by the chance of having to retry elsewhere."""
+        if self.latencies:
+            latency = sorted(self.latencies)[len(self.latencies) // 2]
+        else:
+            latency = AI_HEDGE_DEFAULT_DELAY
+        return latency / max(0.1, 1 - self.error_rate)
+
+class ProviderRouter:
+    """Orders providers by expected latency and skips dead or throttled ones."""
+
+    def __init__(self, providers: List[str]):
+        self.providers = providers
+        self.health = {provider: ProviderHealth() for provider in providers}
+
+    def available(self, provider: str) -> bool:
+        """Whether a call to provider may be attempted right now (no side effects)."""
+        if provider not in PROVIDER_CALLS or not is_provider_configured(provider):
+            return False
+        health = self.health[provider]
+        now = time.monotonic()
+        if now < health.rate_limited_until:
+            return False
+        if health.state == "open":
+            return now >= health.open_until
+        if health.state == "half_open":
+            return not health.probing
+        return True
+
+    def acquire(self, provider: str) -> bool:
+        """Claim a call slot; an open breaker past its cooldown admits one probe."""
+        if not self.available(provider):
+            return False
+        health = self.health[provider]
+        if health.state in ("open", "half_open"):
+            health.state = "half_open"
+            health.probing = True
+            logger.info(f"🔌 Probing {provider} (circuit half-open)")
+        return True
+
+    def ordered_providers(self) -> List[str]:
+        """Available providers, fastest expected first (ties keep AI_PROVIDERS order)."""
+        candidates = [p for p in self.providers if self.available(p)]
+        return sorted(candidates, key=lambda p: self.health[p].expected_latency())
+
+    def record_success(self, provider: str, latency: float) -> None:
+        health = self.health[provider]
+        health.latencies.append(latency)
+        health.outcomes.append((time.monotonic(), True))
+        health.consecutive_failures = 0
+        health.probing = False
+        if health.state != "closed":
+            logger.info(f"🔌 Circuit closed for {provider}")
+        health.state = "closed"
+        health.open_seconds = ROUTER_OPEN_SECONDS
+
+    def record_failure(self, provider: str) -> None:
+        health = self.health[provider]
+        now = time.monotonic()
+        health.outcomes.append((now, False))
+        health.consecutive_failures += 1
+
+        if health.state == "half_open":
+            # Failed probe: reopen with a longer cooldown
+            health.open_seconds = min(ROUTER_MAX_OPEN_SECONDS, health.open_seconds * 2)
+            health.state = "open"
+        elif health.consecutive_failures >= ROUTER_FAILURE_THRESHOLD:
+            health.state = "open"
+        else:
+            return
+
+        health.probing = False
+        health.open_until = now + health.open_seconds
+        logger.warning(f"🔌 Circuit open for {provider} ({health.open_seconds:.0f}s)")
+
+    def record_rate_limit(self, provider: str, retry_after: float) -> None:
+        health = self.health[provider]
+        health.rate_limited_until = time.monotonic() + retry_after
+        health.probing = False
+        logger.warning(f"⏳ {provider} rate limited for {retry_after:.0f}s")
+
+    def snapshot(self) -> Dict[str, any]:
+        now = time.monotonic()
+        return {
+            provider: {
+                "configured": is_provider_configured(provider),
+                "state": health.state,
+                "error_rate": round(health.error_rate, 3),
+                "expected_latency": round(health.expected_latency(), 3),
+                "rate_limited_for": max(0.0, round(health.rate_limited_until - now, 1))
+            }
+            for provider, health in self.health.items()
+        }
+
+provider_router = ProviderRouter(AI_PROVIDERS)
+
+def _accept_reply(reply: Optional[Dict[str, any]], expect_batch: bool) -> Optional[Dict[str, any]]:
+    """A batch reply for batch prompts, otherwise a schema-valid decision; None if it is neither."""
+    if expect_batch:
+        return reply if isinstance(reply, dict) and isinstance(reply.get("decisions"), list) else None
+    return validate_decision(reply)
+
+async def _call_provider(provider: str, prompt: AIPrompt, user_id: int,
+                         expect_batch: bool = False) -> Optional[Dict[str, any]]:
+    """Call a single provider unless it is throttled, feeding the outcome to the router."""
+    if not provider_router.available(provider):
+        return None
+    if not rate_limiter.try_acquire(user_id, provider):
+        logger.info(f"⏳ Skipping throttled provider {provider} for user {user_id}")
+        return None
+    if not provider_router.acquire(provider):
+        return None
+
+    started = time.monotonic()
+    try:
+        decision = await PROVIDER_CALLS[provider](prompt, user_id)
+    except ProviderRateLimitError as e:
+        provider_router.record_rate_limit(provider, e.retry_after)
+        raise
+    except ProviderAbstained:
+        provider_router.health[provider].probing = False
+        return None
+    except asyncio.CancelledError:
+        provider_router.health[provider].probing = False
+        raise
+    except Exception:
+        provider_router.record_failure(provider)
+        raise
+
+    decision = _accept_reply(decision, expect_batch)
+    if decision:
+        provider_router.record_success(provider, time.monotonic() - started)
+    else:
+        provider_router.record_failure(provider)
+    return decision
+
+def hedge_delay(provider: str) -> float:
+    """How long to wait on a provider before firing the next one."""
+    samples = sorted(provider_router.health[provider].latencies)
+    if len(samples) < 5:
+        return AI_HEDGE_DEFAULT_DELAY
+    index = min(len(samples) - 1, int(AI_HEDGE_PERCENTILE * len(samples)))
+    return max(AI_HEDGE_MIN_DELAY, samples[index])
+
+async def _sequential_decision(prompt: AIPrompt, user_id: int,
+                               expect_batch: bool = False) -> Tuple[Optional[str], Optional[Dict[str, any]]]:
+    """Try each provider in order until one returns a decision."""
+    for provider in provider_router.ordered_providers():
+        try:
+            decision = await _call_provider(provider, prompt, user_id, expect_batch)
+            if decision:
+                return provider, decision
+        except Exception as e:
+            logger.warning(f"Provider {provider} failed: {str(e)}")
+    return None, None
+
+async def _hedged_decision(prompt: AIPrompt, user_id: int,
+                           expect_batch: bool = False) -> Tuple[Optional[str], Optional[Dict[str, any]]]:
+    """Race providers: start the next one whenever the latest exceeds its hedge
+    delay (or fails), return the first valid decision and cancel the rest."""
+    remaining = provider_router.ordered_providers()
+    running: Dict[asyncio.Task, str] = {}
+
+    def launch_next() -> Optional[str]:
+        if not remaining:
+            return None
+        provider = remaining.pop(0)
+        running[asyncio.create_task(_call_provider(provider, prompt, user_id, expect_batch))] = provider
+        return provider
+
+    latest = launch_next()
+    try:
+        while running:
+            timeout = hedge_delay(latest) if remaining else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                provider = running.pop(task)
+                try:
+                    decision = task.result()
+                except Exception as e:
+                    logger.warning(f"Provider {provider} failed: {str(e)}")
+                    continue
+                if decision:
+                    return provider, decision
+
+            # Hedge on slowness, or replace a provider that just failed
+            latest = launch_next() or latest
+        return None, None
+    finally:
+        for task in running:
+            task.cancel()
+
+async def _request_decision(prompt: AIPrompt, user_id: int,
+                            expect_batch: bool = False) -> Tuple[Optional[str], Optional[Dict[str, any]]]:
+    """Race providers (hedged) or try them strictly in order."""
+    if AI_HEDGE_ENABLED:
+        return await _hedged_decision(prompt, user_id, expect_batch)
+    return await _sequential_decision(prompt, user_id, expect_batch)
+
+# ----------------------------
+# Decision Batching
+# ----------------------------
+AI_BATCH_ENABLED = os.getenv('AI_BATCH_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+AI_BATCH_WINDOW = float(os.getenv('AI_BATCH_WINDOW', 2.0))  # seconds to gather requests
+AI_BATCH_MAX = int(os.getenv('AI_BATCH_MAX', 16))
+
+def split_batch_reply(reply: Optional[Dict[str, any]], size: int) -> List[Optional[Dict[str, any]]]:
+    """Decisions from a batched reply by pet id; None where a pet is missing or invalid."""
+    decisions: List[Optional[Dict[str, any]]] = [None] * size
+    entries = reply.get("decisions") if isinstance(reply, dict) else None
+    if not isinstance(entries, list):
+        return decisions
+    for position, entry in enumerate(entries):
+        decision = validate_decision(entry)
+        if not decision:
+            continue
+        index = entry.get("id", position)
+        if isinstance(index, int) and 0 <= index < size and decisions[index] is None:
+            decisions[index] = decision
+    return decisions
+
+class DecisionBatcher:
+    """Gathers decision requests for up to `window` seconds (or `max_size`
+    requests) and answers them with one provider call, fanning results back
+    to each waiting caller. Pets missing from a batched reply get one more
+    batch of their own; only what that second batch misses is retried alone.
+    """
+
+    def __init__(self, window: float = AI_BATCH_WINDOW, max_size: int = AI_BATCH_MAX):
+        self.window = window
+        self.max_size = max_size
+        self.pending: List[Tuple["PetStats", int, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks: set = set()
+        self.metrics = defaultdict(int)
+
+    async def decide(self, stats: "PetStats", user_id: int) -> Tuple[Optional[str], Optional[Dict[str, any]]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((stats, user_id, future))
+        if len(self.pending) >= self.max_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch: List[Tuple["PetStats", int, asyncio.Future]], first_try: bool = True) -> None:
+        try:
+            if len(batch) == 1:
+                stats, user_id, future = batch[0]
+                result = await _request_decision(build_prompt(stats), user_id)
+                if not future.done():
+                    future.set_result(result)
+                return
+
+            self.metrics["batches"] += 1
+            self.metrics["batched_requests"] += len(batch)
+            # The batch is charged to its first user's rate limits
+            provider, reply = await _request_decision(build_batch_prompt([item[0] for item in batch]), batch[0][1],
+                                                      expect_batch=True)
+            if not reply:
+                if not first_try:
+                    self.metrics["retried_alone"] += len(batch)
+                    await asyncio.gather(*(self._run([item]) for item in batch))
+                    return
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_result((None, None))
+                return
+
+            missing = []
+            for item, decision in zip(batch, split_batch_reply(reply, len(batch))):
+                future = item[2]
+                if future.done():
+                    continue
+                if decision:
+                    future.set_result((provider, decision))
+                else:
+                    missing.append(item)
+            if len(missing) > 1 and first_try:
+                self.metrics["retried_as_batch"] += len(missing)
+                await self._run(missing, first_try=False)
+            elif missing:
+                self.metrics["retried_alone"] += len(missing)
+                await asyncio.gather(*(self._run([item]) for item in missing))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+decision_batcher = DecisionBatcher()
+
+def validate_decision(candidate: any) -> Optional[Dict[str, any]]:
+    """Strict decision schema: a known action (required), priority defaulting
+    to medium and string reasoning. Anything else is rejected as None."""
+    if not isinstance(candidate, dict):
+        return None
+    action = candidate.get("action")
+    if not isinstance(action, str) or action.strip().lower() not in AI_ACTIONS:
+        return None
+    priority = candidate.get("priority")
+    priority = priority.strip().lower() if isinstance(priority, str) else ""
+    reasoning = candidate.get("reasoning")
     return {
-        "action": detected_action,
-        "reasoning": "Parsed from AI text response",
-        "priority": "medium"
+        "action": action.strip().lower(),
+        "reasoning": reasoning if isinstance(reasoning, str) else "",
+        "priority": priority if priority in DECISION_PRIORITIES else "medium"
     }
 
+def _first_json(text: str) -> any:
+    """The whole text as JSON, else the first JSON object/array embedded in it."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    decoder = json.JSONDecoder()
+    for index, char in enumerate(text):
+        if char in "{[":
+            try:
+                return decoder.raw_decode(text, index)[0]
+            except ValueError:
+                continue
+    return None
 
+def _parse_ai_response(response_text: str, expect_batch: bool = False) -> Optional[Dict[str, any]]:
+    """Parse AI response from any provider into standard format (None if invalid).
 
+    Only replies to batch prompts may come back as {"decisions": [...]}; those
+    are split up by DecisionBatcher.
+    """
+    response_json = _first_json(response_text)
+    if expect_batch:
+        if isinstance(response_json, list):
+            return {"decisions": response_json}
+        if isinstance(response_json, dict) and isinstance(response_json.get("decisions"), list):
+            return response_json
+        return None
+
+    if response_json is not None:
+        return validate_decision(response_json)
+
+    # Broken JSON: trust an explicit "action" field or a bare action word, never
+    # an action merely mentioned in free text
+    decision = early_decision(response_text, require_priority=False)
+    if decision:
+        return decision
+    word = response_text.strip().strip('".').lower()
+    if word in AI_ACTIONS:
+        return {"action": word, "reasoning": "Parsed from AI text response", "priority": "medium"}
+    return None
 
 def parse_ai_response_fallback(response: str) -> Dict[str, any]:
     """Fallback parser for non-JSON AI responses."""
@@ -389,55 +1332,294 @@ def parse_ai_response_fallback(response: str) -> Dict[str, any]:
         "priority": "medium"
     }
 
-def get_fallback_decision(stats: Dict[str, any]) -> Dict[str, any]:
-    """Fallback decision logic when AI is unavailable."""
-    # Emergency situations
-    if stats['health'] < 25:
-        return {"action": "emergency", "reasoning": "Critical health - emergency needed", "priority": "high"}
+# ----------------------------
+# Rules Engine
+# ----------------------------
+# Each rule: (name, condition, action, reasoning, priority). The first
+# matching rule wins, so order encodes priority.
+DecisionRule = Tuple[str, Callable[[Dict[str, any]], bool], str, str, str]
+
+DECISIVE_RULES: List[DecisionRule] = [
+    ("critical_health", lambda s: s['health'] < 25,
+     "emergency", "Critical health - emergency needed", "high"),
+    ("resting", lambda s: s['is_sleeping'] and s['energy'] < 40,
+     "wait", "Pet is asleep and still recovering energy", "low"),
+    ("rested", lambda s: s['is_sleeping'] and s['energy'] > 60,
+     "wake", "Pet well-rested, should wake up", "medium"),
+    ("starving", lambda s: not s['is_sleeping'] and s['hunger'] < 20 and s['energy'] >= 20,
+     "feed", "Pet is starving", "high"),
+    ("exhausted", lambda s: not s['is_sleeping'] and s['energy'] < 20 and s['hunger'] >= 30,
+     "sleep", "Pet is exhausted", "high"),
+    ("all_fine", lambda s: not s['is_sleeping'] and min(
+        s['energy'], s['clean'], s['health'], s['hunger'], s['happiness']) >= 60,
+     "wait", "All stats acceptable", "low"),
+]
 
-    # Basic needs
-    if stats['is_sleeping'] and stats['energy'] > 45:
-        return {"action": "wake", "reasoning": "Pet well-rested, should wake up", "priority": "medium"}
+FALLBACK_RULES: List[DecisionRule] = [
+    ("critical_health", lambda s: s['health'] < 25,
+     "emergency", "Critical health - emergency needed", "high"),
+    ("rested", lambda s: s['is_sleeping'] and s['energy'] > 45,
+     "wake", "Pet well-rested, should wake up", "medium"),
+    ("hungry", lambda s: not s['is_sleeping'] and s['hunger'] < 30,
+     "feed", "Pet is hungry", "high"),
+    ("tired", lambda s: not s['is_sleeping'] and s['energy'] < 20,
+     "sleep", "Pet needs rest", "high"),
+    ("dirty", lambda s: not s['is_sleeping'] and s['clean'] < 40,
+     "bathe", "Pet needs cleaning", "medium"),
+    ("bored", lambda s: not s['is_sleeping'] and s['happiness'] < 40 and s['energy'] > 40,
+     "play", "Pet needs fun", "low"),
+]
 
-    if not stats['is_sleeping'] and stats['hunger'] < 30:
-        return {"action": "feed", "reasoning": "Pet is hungry", "priority": "high"}
+# How many decisions each path handled ("rules", "cache", "ai:<provider>", "fallback")
+decision_counters = defaultdict(int)
 
-    if not stats['is_sleeping'] and stats['energy'] < 20:
-        return {"action": "sleep", "reasoning": "Pet needs rest", "priority": "high"}
+def match_rules(stats: Dict[str, any], rules: List[DecisionRule]) -> Optional[Dict[str, any]]:
+    """Return the decision of the first rule whose condition holds, if any."""
+    for name, condition, action, reasoning, priority in rules:
+        if condition(stats):
+            return {"action": action, "reasoning": reasoning, "priority": priority, "rule": name}
+    return None
 
-    if not stats['is_sleeping'] and stats['clean'] < 40:
-        return {"action": "bathe", "reasoning": "Pet needs cleaning", "priority": "medium"}
+def get_rule_decision(stats: Dict[str, any]) -> Optional[Dict[str, any]]:
+    """Resolve clear-cut states locally; None means the state needs the AI."""
+    decision = match_rules(stats, DECISIVE_RULES)
+    if decision:
+        decision_counters['rules'] += 1
+    return decision
 
-    if not stats['is_sleeping'] and stats['happiness'] < 40 and stats['energy'] > 40:
-        return {"action": "play", "reasoning": "Pet needs fun", "priority": "low"}
+def get_fallback_decision(stats: Dict[str, any]) -> Dict[str, any]:
+    """Fallback decision logic when AI is unavailable."""
+    decision_counters['fallback'] += 1
+    return match_rules(stats, FALLBACK_RULES) or {
+        "action": "wait", "reasoning": "All stats acceptable", "priority": "low"
+    }
+
+# ----------------------------
+# Stat Trajectory Prediction
+# ----------------------------
+PREDICT_MIN_INTERVAL = float(os.getenv('PREDICT_MIN_INTERVAL', 20))
+PREDICT_MAX_INTERVAL = float(os.getenv('PREDICT_MAX_INTERVAL', 600))
+PREDICT_SAFETY = 0.8      # wake at 80% of the predicted time to a threshold
+PREDICT_ALPHA = 0.3       # EWMA weight of the newest rate sample
+
+# Thresholds from FALLBACK_RULES that trigger an action: (field, threshold, crosses when)
+AWAKE_THRESHOLDS = [("health", 25, "below"), ("hunger", 30, "below"), ("energy", 20, "below"),
+                    ("clean", 40, "below"), ("happiness", 40, "below")]
+SLEEPING_THRESHOLDS = [("health", 25, "below"), ("energy", 45, "above")]
+
+class StatTrajectory:
+    """Learns per-second drift of a pet's stats and predicts the next threshold crossing."""
+    FIELDS = ("hunger", "energy", "clean", "happiness", "health")
+
+    def __init__(self):
+        self.rates: Dict[Tuple[str, bool], float] = {}  # (field, is_sleeping) -> units/second
+        self.last: Optional["PetStats"] = None
+        self.last_at = 0.0
+
+    def observe(self, stats: "PetStats", acted: bool = False) -> None:
+        """Record a snapshot; intervals that contained an action are not learned from."""
+        now = time.monotonic()
+        last = self.last
+        if last is not None and not acted and last.is_sleeping == stats.is_sleeping:
+            elapsed = now - self.last_at
+            if elapsed > 0:
+                for field in self.FIELDS:
+                    sample = (stats[field] - last[field]) / elapsed
+                    key = (field, stats.is_sleeping)
+                    previous = self.rates.get(key)
+                    self.rates[key] = sample if previous is None else (
+                        PREDICT_ALPHA * sample + (1 - PREDICT_ALPHA) * previous)
+        self.last, self.last_at = stats, now
+
+    def seconds_to_threshold(self, stats: "PetStats") -> Optional[float]:
+        """Predicted seconds until the first threshold is crossed (0 if already past);
+        None while any relevant rate is still unknown."""
+        thresholds = SLEEPING_THRESHOLDS if stats.is_sleeping else AWAKE_THRESHOLDS
+        soonest = float("inf")
+        for field, threshold, direction in thresholds:
+            value = stats[field]
+            if (value < threshold) if direction == "below" else (value > threshold):
+                return 0.0
+            rate = self.rates.get((field, stats.is_sleeping))
+            if rate is None:
+                return None
+            moving_towards = rate < 0 if direction == "below" else rate > 0
+            if moving_towards:
+                soonest = min(soonest, abs(value - threshold) / abs(rate))
+        return soonest
+
+    def next_check_in(self, stats: "PetStats", default: float) -> float:
+        """Delay before the next check: just before the predicted crossing."""
+        remaining = self.seconds_to_threshold(stats)
+        if remaining is None:
+            return default
+        return max(PREDICT_MIN_INTERVAL, min(PREDICT_MAX_INTERVAL, remaining * PREDICT_SAFETY))
 
-    return {"action": "wait", "reasoning": "All stats acceptable", "priority": "low"}
 # ----------------------------
 # Server Communication
 # ----------------------------
 async def log_pet_error(user_id: int, error_message: str) -> None:
     """Log errors to the server."""
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            await client.post(
-                f"{SERVER_URL}/UserErrors",
-                json={"user_id": user_id, "error": error_message}
-            )
+        await get_http_client().post(
+            f"{SERVER_URL}/UserErrors",
+            json={"user_id": user_id, "error": error_message},
+            timeout=SERVER_HTTP_TIMEOUT
+        )
         logger.info(f"Logged error for user {user_id}")
     except Exception as e:
         logger.error(f"Error logging error for user {user_id}: {e}")
 
-async def save_pet_stats(user_id: int, stats: Dict[str, int]) -> None:
-    """Save pet stats to the server."""
-    try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            await client.post(
-                f"{SERVER_URL}/Pet_stats",
-                json={"user_id": user_id, "stats": stats}
+async def _post_pet_stats(user_id: int, stats: "PetStats") -> None:
+    """POST a single stats snapshot to the server (raises on failure)."""
+    response = await get_http_client().post(
+        f"{SERVER_URL}/Pet_stats",
+        json={"user_id": user_id, "stats": dict(stats)},
+        timeout=SERVER_HTTP_TIMEOUT
+    )
+    response.raise_for_status()
+
+# ----------------------------
+# Stats Write-Behind Buffer
+# ----------------------------
+STATS_BATCH_URL = os.getenv('STATS_BATCH_URL', f"{SERVER_URL}/Pet_stats/batch")
+STATS_FLUSH_SIZE = int(os.getenv('STATS_FLUSH_SIZE', 25))
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', 15))
+STATS_RETRY_LIMIT = int(os.getenv('STATS_RETRY_LIMIT', 500))
+STATS_DEDUP_MAX_USERS = int(os.getenv('STATS_DEDUP_MAX_USERS', 5000))
+
+class StatsBuffer:
+    """Coalesces stats from all sessions and flushes them as one batched request.
+
+    Only the newest snapshot per user is kept, snapshots identical to the last
+    one the server accepted are dropped, and failed flushes are requeued into a
+    bounded retry queue (oldest users dropped first).
+    """
+
+    def __init__(self, flush_size: int = STATS_FLUSH_SIZE,
+                 flush_interval: float = STATS_FLUSH_INTERVAL,
+                 retry_limit: int = STATS_RETRY_LIMIT):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retry_limit = retry_limit
+        self.pending: Dict[int, "PetStats"] = {}
+        self.retry: "OrderedDict[int, PetStats]" = OrderedDict()
+        # Last accepted snapshot per user for de-duplication, LRU-bounded so
+        # churned users don't accumulate
+        self.last_sent: "OrderedDict[int, PetStats]" = OrderedDict()
+        self.batch_supported = True
+        self.metrics = defaultdict(int)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def add(self, user_id: int, stats: "PetStats") -> bool:
+        """Queue a snapshot; returns False if it was dropped as unchanged."""
+        if user_id not in self.pending and self.last_sent.get(user_id) == stats:
+            self.metrics['duplicates_dropped'] += 1
+            return False
+
+        self.pending[user_id] = stats
+        self.retry.pop(user_id, None)  # newer snapshot supersedes a failed one
+        self.metrics['queued'] += 1
+
+        if len(self.pending) + len(self.retry) >= self.flush_size and self._wakeup:
+            self._wakeup.set()
+        return True
+
+    def _requeue(self, entries: Dict[int, "PetStats"]) -> None:
+        """Put failed snapshots back, unless a newer one arrived meanwhile."""
+        for user_id, stats in entries.items():
+            if user_id in self.pending:
+                continue
+            self.retry[user_id] = stats
+            self.retry.move_to_end(user_id)
+
+        while len(self.retry) > self.retry_limit:
+            dropped_user, _ = self.retry.popitem(last=False)
+            self.metrics['retry_dropped'] += 1
+            logger.warning(f"⚠️ Stats retry queue full, dropped snapshot for user {dropped_user}")
+
+    async def _send(self, batch: Dict[int, "PetStats"]) -> Dict[int, "PetStats"]:
+        """Send a batch and return the entries that could not be delivered."""
+        if self.batch_supported:
+            response = await get_http_client().post(
+                STATS_BATCH_URL,
+                json={"stats": [{"user_id": user_id, "stats": dict(stats)} for user_id, stats in batch.items()]},
+                timeout=SERVER_HTTP_TIMEOUT
             )
-        logger.info(f"Saved stats for user {user_id}")
-    except Exception as e:
-        logger.error(f"Error saving stats for user {user_id}: {e}")
+            if response.status_code in (404, 405):
+                logger.warning("⚠️ Batched stats endpoint unavailable, falling back to per-user posts")
+                self.batch_supported = False
+            else:
+                response.raise_for_status()
+                self.metrics['requests'] += 1
+                return {}
+
+        user_ids = list(batch)
+        results = await asyncio.gather(
+            *(_post_pet_stats(user_id, batch[user_id]) for user_id in user_ids),
+            return_exceptions=True
+        )
+        self.metrics['requests'] += len(user_ids)
+        return {
+            user_id: batch[user_id]
+            for user_id, result in zip(user_ids, results)
+            if isinstance(result, Exception)
+        }
+
+    async def flush(self) -> None:
+        """Flush retried and pending snapshots in a single request."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self.pending and not self.retry:
+                return
+
+            batch = dict(self.retry)
+            batch.update(self.pending)
+            self.retry.clear()
+            self.pending.clear()
+
+            try:
+                failed = await self._send(batch)
+            except Exception as e:
+                logger.error(f"Error flushing stats for {len(batch)} users: {e}")
+                failed = batch
+
+            for user_id, stats in batch.items():
+                if user_id not in failed:
+                    self.last_sent[user_id] = stats
+                    self.last_sent.move_to_end(user_id)
+            while len(self.last_sent) > STATS_DEDUP_MAX_USERS:
+                self.last_sent.popitem(last=False)
+            self.metrics['flushed'] += len(batch) - len(failed)
+
+            if failed:
+                self._requeue(failed)
+            logger.info(f"📤 Flushed stats for {len(batch) - len(failed)}/{len(batch)} users")
+
+    async def run(self) -> None:
+        """Flush on the size threshold or every flush_interval seconds."""
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+        finally:
+            self._wakeup = None
+
+stats_buffer = StatsBuffer()
+
+async def save_pet_stats(user_id: int, stats: "PetStats") -> None:
+    """Queue pet stats for the next batched write to the server."""
+    if stats_buffer.add(user_id, stats):
+        logger.info(f"Queued stats for user {user_id}")
 
 
 
@@ -454,104 +1636,461 @@ ROOMS = {
 # ===========================
 
 
-def extract_stats(message: str) -> Dict[str, int]:
-    """Extract pet stats from Telegram messages (handles bold formatting)."""
-    stats = {
-        'energy': 0,
-        'clean': 0,
-        'health': 0,
-        'hunger': 0,
-        'happiness': 0,
-        'is_sleeping': False,
-        'in_bedroom': False,
-        'current_room': None
-    }
+class PetStats:
+    """Compact immutable stats record produced by extract_stats.
 
-    if not message:
-        return stats
-
-    # Detect current room
-    room_identifiers = {
-        "Bedroom": ["🛌** You are in the Bedroom!**", "It's time for a nap!"],
-        "Bathroom": ["🚽** You are in the Bathroom!**", "🛁 Bath time!"],
-        "Kitchen": ["🍽** You're in the Kitchen!**", "🍳 Scroll to find the desired food!"],
-        "Games": ["🕹️** Welcome to the Game Room!**", "🎮 Ready for a game time?"]
+    Slotted to keep per-session memory small, hashable so it can key caches,
+    and supports item access and keys() so dict-style callers
+    (stats['energy'], dict(stats)) keep working.
+    """
+    __slots__ = ('energy', 'clean', 'health', 'hunger', 'happiness',
+                 'is_sleeping', 'in_bedroom', 'current_room')
+
+    def __init__(self, energy: int = 0, clean: int = 0, health: int = 0, hunger: int = 0,
+                 happiness: int = 0, is_sleeping: bool = False, in_bedroom: bool = False,
+                 current_room: Optional[str] = None):
+        init = object.__setattr__
+        init(self, 'energy', energy)
+        init(self, 'clean', clean)
+        init(self, 'health', health)
+        init(self, 'hunger', hunger)
+        init(self, 'happiness', happiness)
+        init(self, 'is_sleeping', is_sleeping)
+        init(self, 'in_bedroom', in_bedroom)
+        init(self, 'current_room', current_room)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("PetStats is immutable; use replace()")
+
+    def __delattr__(self, key):
+        raise AttributeError("PetStats is immutable")
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.__slots__
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self) -> Dict[str, any]:
+        return dict(zip(self.__slots__, self._values()))
+
+    def replace(self, **changes) -> "PetStats":
+        """Copy with some fields changed."""
+        return PetStats(**{**self.to_dict(), **changes})
+
+    def diff(self, other: Optional["PetStats"]) -> Dict[str, Tuple[any, any]]:
+        """Fields that differ from other, as {field: (other_value, new_value)}."""
+        if other is None:
+            return {key: (None, getattr(self, key)) for key in self.__slots__}
+        changes = {}
+        for key in self.__slots__:
+            old, new = other[key], getattr(self, key)
+            if old != new:
+                changes[key] = (old, new)
+        return changes
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PetStats):
+            return self._values() == other._values()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._values())
+
+    def __reduce__(self):
+        return (PetStats, self._values())
+
+    def __repr__(self) -> str:
+        return f"PetStats({self.to_dict()})"
+
+ROOM_IDENTIFIERS = {
+    "Bedroom": ["🛌** You are in the Bedroom!**", "It's time for a nap!"],
+    "Bathroom": ["🚽** You are in the Bathroom!**", "🛁 Bath time!"],
+    "Kitchen": ["🍽** You're in the Kitchen!**", "🍳 Scroll to find the desired food!"],
+    "Games": ["🕹️** Welcome to the Game Room!**", "🎮 Ready for a game time?"]
+}
+SLEEP_PHRASES = ["PettBro is sleeping 😴", "It's time for a nap!", "🌃 It's time for a nap!"]
+
+def _build_phrase_tags() -> Dict[str, frozenset]:
+    """Map every marker phrase to the room/sleep tags it implies.
+
+    A phrase also inherits the tags of any phrase contained in it, because a
+    single non-overlapping scan only reports the longer match.
+    """
+    tags = defaultdict(set)
+    for room, phrases in ROOM_IDENTIFIERS.items():
+        for phrase in phrases:
+            tags[phrase].add(room)
+    for phrase in SLEEP_PHRASES:
+        tags[phrase].add("sleeping")
+    return {
+        phrase: frozenset().union(*(t for other, t in tags.items() if other in phrase))
+        for phrase in tags
     }
 
-    for room_name, phrases in room_identifiers.items():
-        if any(phrase in message for phrase in phrases):
-            stats['current_room'] = room_name
-            break
+PHRASE_TAGS = _build_phrase_tags()
+PHRASE_RE = re.compile('|'.join(re.escape(p) for p in sorted(PHRASE_TAGS, key=len, reverse=True)))
+
+# Labelled ("🍗 | Hunger: **50**") and plain ("🍗 **50**") stat markers in one pattern
+STAT_EMOJIS = {"🍗": "hunger", "❤️": "health", "🔋": "energy", "🙂": "happiness", "🧼": "clean"}
+STAT_RE = re.compile(
+    r'(🍗|❤️|🔋|🙂|🧼)\s*(?:\|\s*(Hunger|Health|Energy|Happiness|Clean):\s*)?\*\*(\d+)\*\*'
+)
 
-    # Detect sleep status
-    stats['is_sleeping'] = any(
-        phrase in message 
-        for phrase in ["PettBro is sleeping 😴", "It's time for a nap!", "🌃 It's time for a nap!"]
+def extract_stats(message: str) -> PetStats:
+    """Extract pet stats from Telegram messages (handles bold formatting)."""
+    if not message:
+        return PetStats()
+
+    # Detect current room and sleep status in one scan over the marker phrases
+    found = set()
+    for match in PHRASE_RE.finditer(message):
+        found |= PHRASE_TAGS[match.group()]
+
+    current_room = next((room for room in ROOM_IDENTIFIERS if room in found), None)
+
+    # First labelled and first plain value per stat; the plain format wins
+    labelled = {}
+    plain = {}
+    for emoji, label, value in STAT_RE.findall(message):
+        key = STAT_EMOJIS[emoji]
+        if not label:
+            plain.setdefault(key, value)
+        elif label.lower() == key:
+            labelled.setdefault(key, value)
+
+    values = {key: int(value) for key, value in {**labelled, **plain}.items()}
+    return PetStats(
+        is_sleeping="sleeping" in found,
+        in_bedroom=current_room == "Bedroom",
+        current_room=current_room,
+        **values
     )
-    stats['in_bedroom'] = stats['current_room'] == "Bedroom"
-
-    # Extract stats patterns
-    stat_patterns = [
-        (r'🍗\s*\|\s*Hunger:\s*\*\*(\d+)\*\*', 'hunger'),
-        (r'❤️\s*\|\s*Health:\s*\*\*(\d+)\*\*', 'health'),
-        (r'🔋\s*\|\s*Energy:\s*\*\*(\d+)\*\*', 'energy'),
-        (r'🙂\s*\|\s*Happiness:\s*\*\*(\d+)\*\*', 'happiness'),
-        (r'🧼\s*\|\s*Clean:\s*\*\*(\d+)\*\*', 'clean'),
-        (r'🍗\s*\*\*(\d+)\*\*', 'hunger'),
-        (r'❤️\s*\*\*(\d+)\*\*', 'health'),
-        (r'🔋\s*\*\*(\d+)\*\*', 'energy'),
-        (r'🙂\s*\*\*(\d+)\*\*', 'happiness'),
-        (r'🧼\s*\*\*(\d+)\*\*', 'clean')
-    ]
 
-    for pattern, stat_key in stat_patterns:
-        match = re.search(pattern, message)
-        if match:
+# ===========================
+# TELEGRAM REQUEST SCHEDULER
+# ===========================
+TG_MIN_INTERVAL = float(os.getenv('TG_MIN_INTERVAL', 0.35))        # seconds between requests per account
+TG_CHORE_MAX_FLOOD_WAIT = float(os.getenv('TG_CHORE_MAX_FLOOD_WAIT', 5))
+
+# Lower value = served first
+PRIORITY_EMERGENCY = 0
+PRIORITY_CARE = 1
+PRIORITY_STATUS = 2
+PRIORITY_CHORE = 3
+
+# Priority of Telegram requests issued by the current task (set around actions)
+tg_priority: contextvars.ContextVar = contextvars.ContextVar('tg_priority', default=PRIORITY_STATUS)
+
+@contextlib.contextmanager
+def telegram_priority(priority: int):
+    """Run the enclosed Telegram requests at the given priority."""
+    token = tg_priority.set(priority)
+    try:
+        yield
+    finally:
+        tg_priority.reset(token)
+
+class TelegramThrottled(Exception):
+    """A low-priority request was dropped because the account is flood-waiting."""
+
+class TelegramScheduler:
+    """Serialises one account's MTProto requests: paces them, honours
+    FloodWait exactly, and serves higher-priority requests first."""
+
+    def __init__(self, client: TelegramClient, label: str):
+        self.client = client
+        self.label = label
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self.next_allowed = 0.0
+        self.flood_until = 0.0
+        self.flood_waits = 0
+        self.sent = deque(maxlen=1000)  # request timestamps, for rate reporting
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._worker = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+        while not self.queue.empty():
+            *_, future = self.queue.get_nowait()
+            future.cancel()
+
+    async def call(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) at the current task's priority and await it."""
+        priority = tg_priority.get()
+        if priority >= PRIORITY_CHORE and self.flood_until - time.monotonic() > TG_CHORE_MAX_FLOOD_WAIT:
+            raise TelegramThrottled(f"{self.label} is flood-waiting, skipping chore")
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((priority, next(self._sequence), fn, args, kwargs, future))
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            item = await self.queue.get()
+            priority, sequence, fn, args, kwargs, future = item
+            if future.done():
+                continue
+
+            delay = max(self.next_allowed, self.flood_until) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # Telethon sleeps through short waits itself (flood_sleep_threshold is
+            # left alone: its update loop shares the client); longer ones land here
             try:
-                stats[stat_key] = int(match.group(1))
-            except (ValueError, IndexError):
+                result = await fn(*args, **kwargs)
+            except FloodWaitError as e:
+                self.flood_waits += 1
+                self.flood_until = time.monotonic() + e.seconds
+                if priority >= PRIORITY_CHORE and e.seconds > TG_CHORE_MAX_FLOOD_WAIT:
+                    logger.warning(f"🌊 FloodWait {e.seconds}s for {self.label}, dropping chore")
+                    if not future.done():
+                        future.set_exception(TelegramThrottled(f"{self.label} is flood-waiting, skipping chore"))
+                    continue
+                logger.warning(f"🌊 FloodWait {e.seconds}s for {self.label}, requeueing request")
+                await self.queue.put(item)  # keeps its place in line
                 continue
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                now = time.monotonic()
+                self.sent.append(now)
+                self.next_allowed = now + TG_MIN_INTERVAL
+
+    def snapshot(self) -> Dict[str, any]:
+        now = time.monotonic()
+        return {
+            "requests_last_minute": sum(1 for t in self.sent if now - t < 60),
+            "queue_depth": self.queue.qsize(),
+            "flood_waits": self.flood_waits,
+            "flood_wait_remaining": max(0.0, round(self.flood_until - now, 1))
+        }
+
+telegram_schedulers: "weakref.WeakKeyDictionary[TelegramClient, TelegramScheduler]" = weakref.WeakKeyDictionary()
+
+def start_telegram_scheduler(client: TelegramClient, label: str) -> TelegramScheduler:
+    scheduler = TelegramScheduler(client, label)
+    telegram_schedulers[client] = scheduler
+    scheduler.start()
+    return scheduler
+
+def stop_telegram_scheduler(client: TelegramClient) -> None:
+    scheduler = telegram_schedulers.pop(client, None)
+    if scheduler:
+        scheduler.stop()
+
+async def tg_request(client: TelegramClient, fn, *args, **kwargs):
+    """Issue a Telegram request through the account's scheduler (if running)."""
+    scheduler = telegram_schedulers.get(client)
+    if scheduler is None:
+        return await fn(*args, **kwargs)
+    return await scheduler.call(fn, *args, **kwargs)
+
+# ===========================
+# BOT MESSAGE STREAM
+# ===========================
+CLICK_UPDATE_TIMEOUT = float(os.getenv('CLICK_UPDATE_TIMEOUT', 5))
 
-    return stats
+class BotMessageStream:
+    """Keeps the latest bot message (and its buttons) in memory for one client.
+
+    Fed by Telethon NewMessage/MessageEdited handlers, so actions can read
+    local state and await the next update instead of polling get_messages.
+    """
+
+    def __init__(self, client: TelegramClient):
+        self.client = client
+        self.latest: Optional[Message] = None
+        self.version = 0
+        self._updated = asyncio.Event()
+        self._handlers = []
+
+    async def start(self) -> None:
+        """Register event handlers and seed the latest message once."""
+        new_message = events.NewMessage(chats=BOT_USERNAME, incoming=True)
+        message_edited = events.MessageEdited(chats=BOT_USERNAME, incoming=True)
+        self.client.add_event_handler(self._on_message, new_message)
+        self.client.add_event_handler(self._on_message, message_edited)
+        self._handlers = [(self._on_message, new_message), (self._on_message, message_edited)]
+
+        messages = await tg_request(self.client, self.client.get_messages, BOT_USERNAME, limit=1)
+        if messages and self.latest is None:
+            self._publish(messages[0])
+
+    def stop(self) -> None:
+        for callback, event in self._handlers:
+            self.client.remove_event_handler(callback, event)
+        self._handlers = []
+
+    async def _on_message(self, event) -> None:
+        message = event.message
+        # Ignore edits to messages older than the one we are tracking
+        if self.latest is not None and message.id < self.latest.id:
+            return
+        self._publish(message)
+
+    def _publish(self, message: Message) -> None:
+        message_capture.record("message", text=message.text or "")
+        self.latest = message
+        self.version += 1
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    async def wait_for_update(self, after_version: int, timeout: float,
+                              predicate: Optional[Callable[[Message], bool]] = None) -> Optional[Message]:
+        """Wait for a message newer than after_version (matching predicate, if given)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.version > after_version and self.latest is not None:
+                if predicate is None or predicate(self.latest):
+                    return self.latest
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._updated.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+
+# Streams for running clients (dropped automatically with the client)
+message_streams: "weakref.WeakKeyDictionary[TelegramClient, BotMessageStream]" = weakref.WeakKeyDictionary()
+
+async def start_message_stream(client: TelegramClient) -> BotMessageStream:
+    stream = BotMessageStream(client)
+    message_streams[client] = stream
+    await stream.start()
+    return stream
+
+def stop_message_stream(client: TelegramClient) -> None:
+    stream = message_streams.pop(client, None)
+    if stream:
+        stream.stop()
+
+def stream_version(client: TelegramClient) -> int:
+    stream = message_streams.get(client)
+    return stream.version if stream else 0
+
+async def get_latest_bot_message(client: TelegramClient) -> Optional[Message]:
+    """Latest bot message from the stream, falling back to one MTProto request."""
+    stream = message_streams.get(client)
+    if stream and stream.latest is not None:
+        return stream.latest
+    messages = await tg_request(client, client.get_messages, BOT_USERNAME, limit=1)
+    return messages[0] if messages else None
+
+async def wait_for_bot_update(client: TelegramClient, after_version: int, timeout: float,
+                              predicate: Optional[Callable[[Message], bool]] = None) -> Optional[Message]:
+    """Await the next bot message/edit; without a stream, sleep and poll once."""
+    stream = message_streams.get(client)
+    if stream:
+        return await stream.wait_for_update(after_version, timeout, predicate)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(1.0, timeout))
+        msg = await get_latest_bot_message(client)
+        if msg and (predicate is None or predicate(msg)):
+            return msg
+    return None
+
+# ----------------------------
+# Screen Predicates
+# ----------------------------
+SCREEN_TIMEOUT = float(os.getenv('SCREEN_TIMEOUT', 5))
+
+def message_buttons(msg: Optional[Message]) -> List[str]:
+    """Texts of all inline buttons on a message."""
+    if not msg or not msg.reply_markup:
+        return []
+    return [btn.text for row in msg.reply_markup.rows for btn in row.buttons]
+
+def button_matches(text: str, button: str, exact: bool = False) -> bool:
+    """Case-insensitive partial match, or whole-label match when exact."""
+    if exact:
+        return button.strip().lower() == text.strip().lower()
+    return text.lower() in button.lower()
+
+def has_button(text: str, exact: bool = False) -> Callable[[Message], bool]:
+    """Screen predicate: a button containing (or, if exact, labelled) text is shown."""
+    return lambda msg: any(button_matches(text, btn, exact) for btn in message_buttons(msg))
+
+def in_room(room: str) -> Callable[[Message], bool]:
+    """Screen predicate: the message is the given room's screen."""
+    return lambda msg: extract_stats(msg.text or "")['current_room'] == room
+
+async def wait_for_screen(client: TelegramClient, predicate: Callable[[Message], bool],
+                          timeout: float = SCREEN_TIMEOUT) -> Optional[Message]:
+    """Return the current screen once it satisfies predicate, or None on timeout."""
+    version = stream_version(client)
+    msg = await get_latest_bot_message(client)
+    if msg and predicate(msg):
+        return msg
+    return await wait_for_bot_update(client, version, timeout, predicate)
 
 # ===========================
 # ACTION FUNCTIONS
 # ===========================
 
-async def click(client: TelegramClient, button_text: str, original_call: bool = True) -> bool:
+async def click(client: TelegramClient, button_text: str, original_call: bool = True,
+                exact: bool = False) -> bool:
     """Click a button by text (case-insensitive partial match) with fallback to home/start.
     
     Args:
         client: TelegramClient instance
         button_text: Text to match in buttons
         original_call: Flag to track if this is the first call (not a recursive fallback)
+        exact: Match the whole button label (e.g. "+" must not hit "+5")
     """
     try:
         # Get the latest message
-        messages = await client.get_messages(BOT_USERNAME, limit=1)
-        if not messages:
+        msg = await get_latest_bot_message(client)
+        if not msg:
             logger.warning("No messages found from bot")
             return False
 
-        msg = messages[0]
+        # The previous click may still be rendering: wait for the button to appear
+        if original_call and not has_button(button_text, exact)(msg):
+            msg = await wait_for_screen(client, has_button(button_text, exact)) or msg
+
         if not msg.reply_markup:
             logger.warning("Message has no buttons")
             return False
 
         # Extract and log all available buttons
-        buttons = [btn.text for row in msg.reply_markup.rows for btn in row.buttons]
+        buttons = message_buttons(msg)
         logger.info(f"Available buttons: {', '.join(buttons)}")
 
         # Find matching button (case-insensitive partial match)
         target_button = next(
-            (btn for btn in buttons if button_text.lower() in btn.lower()),
+            (btn for btn in buttons if button_matches(button_text, btn, exact)),
             None
         )
 
         if target_button:
             logger.info(f"Clicking button: {target_button}")
-            await msg.click(text=target_button)
-            await asyncio.sleep(1)
+            version = stream_version(client)
+            await tg_request(client, msg.click, text=target_button)
+            await wait_for_bot_update(client, version, CLICK_UPDATE_TIMEOUT)
             return True
         
         # Only try fallbacks if this is the original call (not a recursive fallback)
@@ -560,17 +2099,19 @@ async def click(client: TelegramClient, button_text: str, original_call: bool =
             home_button = next((btn for btn in buttons if "🏠" in btn), None)
             if home_button:
                 logger.info(f"Target button not found, clicking home button: {home_button}")
-                await msg.click(text=home_button)
-                await asyncio.sleep(1)
+                version = stream_version(client)
+                await tg_request(client, msg.click, text=home_button)
+                await wait_for_bot_update(client, version, CLICK_UPDATE_TIMEOUT)
                 # Try again after going home (but mark as not original call)
-                return await click(client, button_text, original_call=False)
+                return await click(client, button_text, original_call=False, exact=exact)
             
             # If no home button, try /start
             logger.info("Target button not found, sending /start command")
-            await client.send_message(BOT_USERNAME, "/start")
-            await asyncio.sleep(1)
+            version = stream_version(client)
+            await tg_request(client, client.send_message, BOT_USERNAME, "/start")
+            await wait_for_bot_update(client, version, CLICK_UPDATE_TIMEOUT)
             # Try again after /start (but mark as not original call)
-            return await click(client, button_text, original_call=False)
+            return await click(client, button_text, original_call=False, exact=exact)
         
         # If we're in a fallback call and still can't find it, give up
         logger.warning(f"Button matching '{button_text}' not found after fallbacks")
@@ -580,6 +2121,111 @@ async def click(client: TelegramClient, button_text: str, original_call: bool =
         logger.error(f"Error in click: {str(e)}")
         return False
 
+# ===========================
+# NAVIGATION GRAPH
+# ===========================
+NAV_MAX_BACK_STEPS = 3
+
+# screen -> {button text: screen it leads to}. Every room is reachable from
+# Home by its own button and returns Home via 🏠.
+NAV_GRAPH: Dict[str, Dict[str, str]] = {
+    "Home": {room: room for room in ROOMS},
+    **{room: {"🏠": "Home"} for room in ROOMS},
+}
+NAV_GRAPH["Kitchen"]["Cafeteria"] = "Cafeteria"
+NAV_GRAPH["Games"]["Games"] = "GameList"
+NAV_GRAPH["GameList"] = {"Doors": "Doors", "Wordle": "Wordle"}
+NAV_GRAPH.update({"Cafeteria": {}, "Doors": {}, "Wordle": {}})
+
+def detect_screen(msg: Optional[Message]) -> Optional[str]:
+    """Identify the current screen from its header, or Home from its room buttons."""
+    if not msg:
+        return None
+    room = extract_stats(msg.text or "")['current_room']
+    if room:
+        return room
+    buttons = message_buttons(msg)
+    if all(any(room in btn for btn in buttons) for room in ("Bedroom", "Kitchen")):
+        return "Home"
+    return None
+
+def plan_route(source: str, target: str, visible_buttons: Optional[List[str]] = None) -> Optional[List[str]]:
+    """Shortest list of buttons from source to target (BFS), or None if unreachable.
+
+    Buttons visible on the current screen that name a screen (or 🏠) are used
+    as extra first hops, so e.g. a Cafeteria button on Home is clicked directly.
+    """
+    if source == target:
+        return []
+
+    first_hops = dict(NAV_GRAPH.get(source, {}))
+    for btn in visible_buttons or []:
+        if "🏠" in btn:
+            first_hops.setdefault("🏠", "Home")
+        for screen in NAV_GRAPH:
+            if screen != source and screen.lower() in btn.lower():
+                first_hops.setdefault(screen, screen)
+
+    queue = deque()
+    visited = {source}
+    for button, screen in first_hops.items():
+        if screen not in visited:
+            visited.add(screen)
+            queue.append((screen, [button]))
+
+    while queue:
+        screen, route = queue.popleft()
+        if screen == target:
+            return route
+        for button, next_screen in NAV_GRAPH.get(screen, {}).items():
+            if next_screen not in visited:
+                visited.add(next_screen)
+                queue.append((next_screen, route + [button]))
+    return None
+
+async def _go_home(client: TelegramClient) -> bool:
+    """Return Home from any screen: 🏠 if shown, else back out, else /start."""
+    for _ in range(NAV_MAX_BACK_STEPS):
+        msg = await get_latest_bot_message(client)
+        if detect_screen(msg) == "Home":
+            return True
+        buttons = message_buttons(msg)
+        if any("🏠" in btn for btn in buttons):
+            return await click(client, "🏠")
+        if not any("⬅️" in btn for btn in buttons):
+            break
+        await click(client, "⬅️")
+
+    logger.info("Home not reachable by buttons, sending /start command")
+    version = stream_version(client)
+    await tg_request(client, client.send_message, BOT_USERNAME, "/start")
+    await wait_for_bot_update(client, version, CLICK_UPDATE_TIMEOUT)
+    return True
+
+async def navigate_to(client: TelegramClient, target: str) -> bool:
+    """Click along the shortest path from the current screen to target."""
+    msg = await get_latest_bot_message(client)
+    current = detect_screen(msg)
+    buttons = message_buttons(msg)
+    route = plan_route(current, target, buttons) if current else None
+    if route and not any(button_matches(route[0], btn) for btn in buttons):
+        # Sub-screens share their room's header but not its buttons (food or potion details)
+        route = None
+
+    if route is None:
+        # Unknown screen: everything is reachable from Home
+        if not await _go_home(client):
+            return False
+        route = plan_route("Home", target) or []
+
+    if route:
+        logger.info(f"🧭 {current or 'Unknown'} → {target}: {' → '.join(route)}")
+    for button in route:
+        if not await click(client, button):
+            logger.error(f"🚫 Failed to find {button} on the way to {target}")
+            return False
+    return True
+
 # ===========================
 # ACTION FUNCTIONS (Updated)
 # ===========================
@@ -590,20 +2236,18 @@ async def sleep_pet(client: TelegramClient) -> bool:
     """Put pet to sleep by clicking Bedroom then Sleep buttons, then return Home."""
     logger.info("😴 Starting sleep sequence")
     
-    if not await click(client, "Bedroom"):
+    if not await navigate_to(client, "Bedroom"):
         logger.error("🚫 Failed to find Bedroom button")
         return False
-    await asyncio.sleep(2)  # Wait after entering bedroom
     
     logger.info("🛏️ Found Bedroom - looking for Sleep button")
     if not await click(client, "sleep"):
         logger.error("🚫 Failed to find Sleep button")
         return False
-    await asyncio.sleep(2)  # Wait after putting to sleep
     
     # Return home
     logger.info("🏠 Returning to Home after sleep")
-    if not await click(client, "🏠"):
+    if not await navigate_to(client, "Home"):
         logger.error("🚫 Failed to find Home button")
         return False
     
@@ -616,20 +2260,18 @@ async def wake_pet(client: TelegramClient) -> bool:
     """Wake pet by clicking Bedroom then Wake buttons, then return Home."""
     logger.info("⏰ Starting wake sequence")
     
-    if not await click(client, "Bedroom"):
+    if not await navigate_to(client, "Bedroom"):
         logger.error("🚫 Failed to find Bedroom button")
         return False
-    await asyncio.sleep(2)  # Wait after entering bedroom
     
     logger.info("🛏️ Found Bedroom - looking for Wake button")
     if not await click(client, "wake"):
         logger.error("🚫 Failed to find Wake button")
         return False
-    await asyncio.sleep(2)  # Wait after waking up
     
     # Return home
     logger.info("🏠 Returning to Home after wake")
-    if not await click(client, "🏠"):
+    if not await navigate_to(client, "Home"):
         logger.error("🚫 Failed to find Home button")
         return False
     
@@ -645,10 +2287,9 @@ async def bathe_pet(client: TelegramClient) -> bool:
     logger.info("🛁 Starting bath sequence")
     
     # Initial bathroom entry
-    if not await click(client, "Bathroom"):
+    if not await navigate_to(client, "Bathroom"):
         logger.error("🚫 Failed to find Bathroom button")
         return False
-    await asyncio.sleep(2)  # Wait after entering bathroom
     
     # Rub sequence
     logger.info("🚿 Found Bathroom - beginning rub sequence (5 rubs)")
@@ -658,21 +2299,16 @@ async def bathe_pet(client: TelegramClient) -> bool:
             return False
             
         logger.info(f"🧽 Completed rub {i}/5")
-        if i < 5:  # Don't wait after the last rub
-            wait_time = random.uniform(2.0, 3.0)
-            await asyncio.sleep(wait_time)
     
     # Shower
     logger.info("🧼 Looking for Shower button")
-    await asyncio.sleep(2)  # Wait before shower
     if not await click(client, "shower"):
         logger.error("🚫 Failed to find Shower button")
         return False
-    await asyncio.sleep(2)  # Wait after shower
     
     # Return home
     logger.info("🏠 Returning to Home")
-    if not await click(client, "🏠"):  # Home button
+    if not await navigate_to(client, "Home"):
         logger.error("🚫 Failed to find Home button")
         return False
     
@@ -696,17 +2332,15 @@ async def play_throw_ball_game(client: TelegramClient) -> bool:
     logger.info("🎾 Starting throw ball game sequence")
     
     # Enter Games section
-    if not await click(client, "Games"):
+    if not await navigate_to(client, "Games"):
         logger.error("🚫 Failed to find Games button")
         return False
-    await asyncio.sleep(2)
     
     # Select Throw Ball game
     logger.info("🕹️ Found Games - looking for Throw button")
     if not await click(client, "throw"):
         logger.error("🚫 Failed to find Throw button")
         return False
-    await asyncio.sleep(2)
     
     # Game attempts loop
     logger.info("🔁 Starting 3 game attempts")
@@ -715,30 +2349,26 @@ async def play_throw_ball_game(client: TelegramClient) -> bool:
         if not await click(client, "⬅️"):
             logger.error("🚫 Failed to find Back arrow")
             return False
-        await asyncio.sleep(1)
         
         # Try Again
         if not await click(client, "try again"):
             logger.error(f"🚫 Failed Try Again {attempt}/3")
             return False
         logger.info(f"🔄 Completed attempt {attempt}/3")
-        await asyncio.sleep(2)
     
     # Final back navigation
     logger.info("↩️ Final navigation to Game Room")
     if not await click(client, "⬅️"):
         logger.error("🚫 Failed to find Back arrow")
         return False
-    await asyncio.sleep(1)
     
     if not await click(client, "Back to game Room"):
         logger.error("🚫 Failed to find Game Room button")
         return False
-    await asyncio.sleep(1)
     
     # Return home
     logger.info("🏠 Returning to Home")
-    if not await click(client, "🏠"):
+    if not await navigate_to(client, "Home"):
         logger.error("🚫 Failed to find Home button")
         return False
     
@@ -749,6 +2379,130 @@ async def play_throw_ball_game(client: TelegramClient) -> bool:
 
 PREFERRED_FOOD = os.getenv('PREFERRED_FOOD', '🍣 Sushi')
 PREFERRED_AMOUNT = int(os.getenv('PREFERRED_AMOUNT', 1))
+
+# ----------------------------
+# Inventory Cache
+# ----------------------------
+FOOD_OPTIONS = [
+    '🍣 Sushi', '🥗 Salad', '🍪 Cookie',
+    '🍔 Burger', '🍕 Pizza', '🍎 Fruit'
+]
+POTION_ITEM = "♥️ Potion"
+INVENTORY_TTL = float(os.getenv('INVENTORY_TTL', 6 * 60 * 60))  # seconds
+ITEM_COUNT_RE = re.compile(r'(\d+)')
+FEED_HISTORY_SIZE = 20
+
+class Inventory:
+    """What the pet owns, learned from Kitchen buttons and our own purchases/uses.
+
+    Counts are None when an item was seen but its quantity wasn't shown.
+    Answers are None ("unknown") until the Kitchen has been seen within INVENTORY_TTL.
+    """
+
+    def __init__(self, items: Optional[Dict[str, Optional[int]]] = None, updated_at: float = 0,
+                 fed_at: Optional[List[float]] = None):
+        self.items: Dict[str, Optional[int]] = dict(items or {})
+        self.updated_at = updated_at
+        self.fed_at: deque = deque(fed_at or (), maxlen=FEED_HISTORY_SIZE)  # consumption history
+        self.dirty = False
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, any]) -> "Inventory":
+        return cls(data.get("items"), data.get("updated_at", 0), data.get("fed_at"))
+
+    def to_dict(self) -> Dict[str, any]:
+        return {"items": dict(self.items), "updated_at": self.updated_at, "fed_at": list(self.fed_at)}
+
+    def _touch(self) -> None:
+        self.dirty = True
+
+    def observe_kitchen(self, buttons: List[str]) -> None:
+        """Replace the inventory with what the Kitchen buttons show."""
+        items = {}
+        for button in buttons:
+            for item in FOOD_OPTIONS + [POTION_ITEM]:
+                if item in button:
+                    count = ITEM_COUNT_RE.search(button.replace(item, ""))
+                    items[item] = int(count.group(1)) if count else None
+        self.items = items
+        self.updated_at = time.time()
+        self._touch()
+
+    def record_purchase(self, item: str, amount: int = 1) -> None:
+        if item in self.items and self.items[item] is None:
+            return
+        self.items[item] = (self.items.get(item) or 0) + amount
+        self._touch()
+
+    def record_use(self, item: str) -> None:
+        if item in FOOD_OPTIONS:
+            self.fed_at.append(time.time())
+            self._touch()
+        count = self.items.get(item)
+        if count is not None:
+            self.items[item] = max(0, count - 1)
+            self._touch()
+
+    def invalidate(self) -> None:
+        """Forget the inventory (e.g. after games that may award items)."""
+        self.updated_at = 0
+        self._touch()
+
+    def has(self, item: str) -> Optional[bool]:
+        if time.time() - self.updated_at > INVENTORY_TTL:
+            return None
+        return item in self.items and self.items[item] != 0
+
+    def has_food(self) -> Optional[bool]:
+        known = [self.has(food) for food in FOOD_OPTIONS]
+        return None if None in known else any(known)
+
+    def feeds_per_hour(self) -> Optional[float]:
+        if len(self.fed_at) < 2:
+            return None
+        span = self.fed_at[-1] - self.fed_at[0]
+        return (len(self.fed_at) - 1) * 3600 / span if span > 0 else None
+
+inventories: "weakref.WeakKeyDictionary[TelegramClient, Inventory]" = weakref.WeakKeyDictionary()
+
+def get_inventory(client: TelegramClient) -> Inventory:
+    inventory = inventories.get(client)
+    if inventory is None:
+        inventory = inventories[client] = Inventory()
+    return inventory
+
+# ----------------------------
+# Food Purchase Planner
+# ----------------------------
+PURCHASE_HORIZON_HOURS = float(os.getenv('PURCHASE_HORIZON_HOURS', 12))
+PURCHASE_MAX_BATCH = int(os.getenv('PURCHASE_MAX_BATCH', 10))
+QUANTITY_STEP_RE = re.compile(r'^\+\s*(\d+)$')
+
+def plan_food_batch(inventory: Inventory) -> int:
+    """How much food to buy: enough for PURCHASE_HORIZON_HOURS of observed
+    consumption, so one Cafeteria trip covers many feeds."""
+    rate = inventory.feeds_per_hour()
+    if rate is None:
+        return PREFERRED_AMOUNT
+    wanted = -(-rate * PURCHASE_HORIZON_HOURS // 1)  # ceil
+    return int(max(PREFERRED_AMOUNT, min(PURCHASE_MAX_BATCH, wanted)))
+
+def plan_quantity_clicks(extra: int, buttons: List[str]) -> List[str]:
+    """Fewest quantity-button clicks adding `extra` units, using any "+N"
+    step buttons the Cafeteria shows alongside the plain "+". Returns exact
+    button labels, to be clicked with click(..., exact=True)."""
+    steps = {1: next((btn for btn in buttons if btn.strip() == "+"), "+")}
+    for button in buttons:
+        match = QUANTITY_STEP_RE.match(button.strip())
+        if match and int(match.group(1)) > 0:
+            steps[int(match.group(1))] = button
+    clicks = []
+    for size in sorted(steps, reverse=True):
+        while extra >= size:
+            clicks.append(steps[size])
+            extra -= size
+    return clicks
+
 async def feed_pet(client: TelegramClient) -> bool:
     """Enhanced pet feeding with food purchasing capability:
     1. Check hunger level first
@@ -759,12 +2513,12 @@ async def feed_pet(client: TelegramClient) -> bool:
     logger.info("🍽️ Starting feeding sequence")
     
     # First check pet stats
-    messages = await client.get_messages(BOT_USERNAME, limit=1)
-    if not messages:
+    msg = await get_latest_bot_message(client)
+    if not msg:
         logger.error("No message received from bot")
         return False
     
-    stats = extract_stats(messages[0].text)
+    stats = extract_stats(msg.text)
     if not stats or stats.get('hunger') is None:
         logger.error("Could not determine hunger level")
         return False
@@ -773,8 +2527,10 @@ async def feed_pet(client: TelegramClient) -> bool:
         logger.info(f"🐾 Pet hunger is {stats['hunger']} (already satisfied)")
         return True
     
-    # Attempt to feed with existing food
-    if await try_feeding(client):
+    # Attempt to feed with existing food, unless we already know there is none
+    if get_inventory(client).has_food() is False:
+        logger.info("📦 Inventory has no food - skipping Kitchen check")
+    elif await try_feeding(client):
         return True
     
     # If feeding failed, purchase food
@@ -791,45 +2547,34 @@ async def try_feeding(client: TelegramClient) -> bool:
     logger.info("🍳 Attempting to feed pet")
     
     # Enter Kitchen
-    if not await click(client, "Kitchen"):
+    if not await navigate_to(client, "Kitchen"):
         logger.error("🚫 Failed to find Kitchen button")
         return False
-    await asyncio.sleep(2)
     
     # Get available food
-    messages = await client.get_messages(BOT_USERNAME, limit=1)
-    if not messages:
+    msg = await wait_for_screen(client, in_room("Kitchen")) or await get_latest_bot_message(client)
+    if not msg:
         logger.warning("No messages found from bot")
         return False
 
-    msg = messages[0]
     if not msg.reply_markup:
         logger.warning("Message has no buttons")
         return False
 
     # Try all food options
-    buttons = [btn.text for row in msg.reply_markup.rows for btn in row.buttons]
+    buttons = message_buttons(msg)
     logger.info(f"Available food: {', '.join(buttons)}")
+    inventory = get_inventory(client)
+    inventory.observe_kitchen(buttons)
     
-    food_options = [
-        '🍣 Sushi', '🥗 Salad', '🍪 Cookie', 
-        '🍔 Burger', '🍕 Pizza', '🍎 Fruit'
-    ]
-    
-    for food in food_options:
+    for food in FOOD_OPTIONS:
         if any(food in btn for btn in buttons):
             if await click(client, food):
+                inventory.record_use(food)
                 logger.info(f"🍗 Fed pet with {food}")
-                await asyncio.sleep(3)
-                
-                # Back navigation
-                await click(client, "⬅️")
-                await asyncio.sleep(1)
-                await click(client, "⬅️")
-                await asyncio.sleep(1)
                 
                 # Return home
-                await click(client, "🏠")
+                await navigate_to(client, "Home")
                 logger.info("✅ Feeding successful")
                 return True
     
@@ -841,46 +2586,43 @@ async def purchase_food(client: TelegramClient) -> bool:
     logger.info("🛒 Starting food purchase sequence")
     
     # Navigate to Cafeteria
-    if not await click(client, "Cafeteria 🏪"):
+    if not await navigate_to(client, "Cafeteria"):
         logger.error("🚫 Failed to find Cafeteria button")
         return False
-    await asyncio.sleep(2)
     
     # Select preferred food
     if not await click(client, PREFERRED_FOOD):
         logger.error(f"🚫 Failed to find {PREFERRED_FOOD}")
         return False
-    await asyncio.sleep(1)
     
     # Adjust quantity
-    for _ in range(PREFERRED_AMOUNT - 1):
-        if not await click(client, "+"):
-            logger.error("🚫 Failed to find + button")
+    inventory = get_inventory(client)
+    amount = plan_food_batch(inventory)
+    msg = await get_latest_bot_message(client)
+    for label in plan_quantity_clicks(amount - 1, message_buttons(msg)):
+        if not await click(client, label, exact=True):
+            logger.error(f"🚫 Failed to find {label} button")
             return False
-        await asyncio.sleep(0.5)
     
     # Complete purchase
     if not await click(client, "Buy 💰"):
         logger.error("🚫 Failed to find Buy button")
         return False
-    await asyncio.sleep(2)
+    inventory.record_purchase(PREFERRED_FOOD, amount)
+    logger.info(f"🧮 Bought {amount}x {PREFERRED_FOOD}")
     
-    # Navigation back
+    # Navigation back to kitchen (feeding continues from there)
     await click(client, "⬅️")
-    await asyncio.sleep(1)
     await click(client, "⚪")
-    await asyncio.sleep(1)
     await click(client, "⬆️")
-    await asyncio.sleep(1)
-    await click(client, "🏠")
     
     logger.info("🛍️ Food purchase completed")
     return True
 
 async def get_pet_stats(client: TelegramClient) -> Dict[str, int]:
     """Get current pet stats"""
-    messages = await client.get_messages(BOT_USERNAME, limit=1)
-    if not messages:
+    msg = await get_latest_bot_message(client)
+    if not msg:
         return default_stats()
 
 async def emergency_care(client: TelegramClient) -> bool:
@@ -893,15 +2635,17 @@ async def emergency_care(client: TelegramClient) -> bool:
     
     logger.info("🚨 Starting emergency care sequence")
     
-    # Step 1: Go to Kitchen
-    if not await click(client, "Kitchen"):
-        logger.error("🚫 Failed to find Kitchen button")
-        return False
-    await asyncio.sleep(2)
-    
-    # Step 2: Check for existing potion
-    if await use_existing_potion(client):
-        return True
+    if get_inventory(client).has(POTION_ITEM) is False:
+        logger.info("📦 Inventory has no potion - skipping Kitchen check")
+    else:
+        # Step 1: Go to Kitchen
+        if not await navigate_to(client, "Kitchen"):
+            logger.error("🚫 Failed to find Kitchen button")
+            return False
+        
+        # Step 2: Check for existing potion
+        if await use_existing_potion(client):
+            return True
     
     # Step 3: Purchase new potion if none found
     logger.info("💊 No potion available - starting purchase sequence")
@@ -917,25 +2661,23 @@ async def use_existing_potion(client: TelegramClient) -> bool:
     logger.info("🔍 Checking for existing potion")
     
     # Get current buttons
-    messages = await client.get_messages(BOT_USERNAME, limit=1)
-    if not messages or not messages[0].reply_markup:
+    msg = await wait_for_screen(client, in_room("Kitchen")) or await get_latest_bot_message(client)
+    if not msg or not msg.reply_markup:
         logger.warning("No buttons found in kitchen")
         return False
     
-    buttons = [btn.text for row in messages[0].reply_markup.rows for btn in row.buttons]
+    buttons = message_buttons(msg)
+    inventory = get_inventory(client)
+    inventory.observe_kitchen(buttons)
     
     # Check for potion button
-    if "♥️ Potion" in buttons:
+    if POTION_ITEM in buttons:
         logger.info("💉 Found potion - administering to pet")
-        if await click(client, "♥️ Potion"):
-            await asyncio.sleep(2)
+        if await click(client, POTION_ITEM):
+            inventory.record_use(POTION_ITEM)
             
             # Navigation back home
-            await click(client, "⬅️")
-            await asyncio.sleep(2)
-            await click(client, "⬅️")
-            await asyncio.sleep(1)
-            await click(client, "🏠")
+            await navigate_to(client, "Home")
             logger.info("✅ Emergency care completed")
             return True
     
@@ -947,30 +2689,25 @@ async def purchase_potion(client: TelegramClient) -> bool:
     logger.info("🏥 Starting potion purchase sequence")
     
     # Navigate to Cafeteria
-    if not await click(client, "Cafeteria"):
+    if not await navigate_to(client, "Cafeteria"):
         logger.error("🚫 Failed to find Cafeteria button")
         return False
-    await asyncio.sleep(2)
     
     # Select potion
     if not await click(client, "♥️ Potion (S)"):
         logger.error("🚫 Failed to find potion button")
         return False
-    await asyncio.sleep(1)
     
     # Buy potion
     if not await click(client, "Buy"):
         logger.error("🚫 Failed to find Buy button")
         return False
-    await asyncio.sleep(2)
+    get_inventory(client).record_purchase(POTION_ITEM)
     
     # Navigation back to kitchen
     await click(client, "⬅️")
-    await asyncio.sleep(1)
     await click(client, "⚪")
-    await asyncio.sleep(1)
     await click(client, "⬆️")
-    await asyncio.sleep(1)
     
     logger.info("🛍️ Potion purchase completed")
     return True
@@ -978,31 +2715,17 @@ async def purchase_potion(client: TelegramClient) -> bool:
 
 async def auto_door(client: TelegramClient, user_id: int) -> None:
     """Automatically interact with doors every 2 hours:
-    1. Games → Games → Doors
+    1. Navigate to Doors (Games → Games → Doors)
     2. Pick random door (Door 1/Door 2/Door 3)
-    3. Click back (⬅️) twice with 2s delay
-    4. Return home (🏠)"""
+    3. Return home"""
     
     logger.info(f"🚪 Starting automated Door sequence for user {user_id}")
     
     try:
-        # First Games button
-        if not await click(client, "Games"):
-            logger.error("🚫 Failed to find first Games button i")
-            return
-        await asyncio.sleep(4)
-        
-        # Second Games button
-        if not await click(client, "Games"):
-            logger.error("🚫 Failed to find second Games button")
-            return
-        await asyncio.sleep(4)
-        
-        # Doors button
-        if not await click(client, "Doors"):
+        # Games → Games → Doors
+        if not await navigate_to(client, "Doors"):
             logger.error("🚫 Failed to find Doors button")
             return
-        await asyncio.sleep(4)
         
         # Random door selection
         doors = ["Door 1", "Door 2", "Door 3"]
@@ -1011,16 +2734,9 @@ async def auto_door(client: TelegramClient, user_id: int) -> None:
             logger.error(f"🚫 Failed to find {selected_door}")
             return
         logger.info(f"🚪 Selected {selected_door}")
-        await asyncio.sleep(4)
-        
-        # First back click
-        if not await click(client, "⬅️"):
-            logger.error("🚫 Failed first back navigation")
-            return
-        await asyncio.sleep(2)
         
         # Return home
-        if not await click(client, "🏠"):
+        if not await navigate_to(client, "Home"):
             logger.error("🚫 Failed to return home")
             return
         
@@ -1030,7 +2746,7 @@ async def auto_door(client: TelegramClient, user_id: int) -> None:
     except Exception as e:
         logger.error(f"❌ Automated Door sequence failed: {str(e)}")
         # Attempt to return home if something went wrong
-        await click(client, "🏠")
+        await navigate_to(client, "Home")
         return False
 async def auto_wordle(client: TelegramClient, user_id: str) -> bool:
     """
@@ -1043,57 +2759,42 @@ async def auto_wordle(client: TelegramClient, user_id: str) -> bool:
     logger.info("🎮 Starting Wordle automation")
     
     # Navigate to Wordle game
-    if not await click(client, "Games 🎮"):
-        logger.error("🚫 Failed to find Games button")
-        return False
-    await asyncio.sleep(4)
-       # Navigate to Wordle game
-    if not await click(client, "Games 🎮"):
-        logger.error("🚫 Failed to find Games button")
-        return False
-    await asyncio.sleep(4)
-    
-    if not await click(client, "Wordle"):
+    if not await navigate_to(client, "Wordle"):
         logger.error("🚫 Failed to find Wordle button")
         return False
-    await asyncio.sleep(3)
     
     # Check current message
-    messages = await client.get_messages(BOT_USERNAME, limit=1)
-    if not messages:
+    msg = await get_latest_bot_message(client)
+    if not msg:
         logger.warning("No messages found from bot")
         return False
     
-    msg = messages[0]
     message_text = msg.text or ""
     
     # Check if already completed today
     if "You've used all your attempts for today" in message_text:
         logger.info("✅ Wordle already completed today")
-        await click(client, "⬅️")
-        await asyncio.sleep(1)
-        await click(client, "⬅️")
-        await asyncio.sleep(1)
-        await click(client, "🏠")
+        await navigate_to(client, "Home")
         return True
    
     # Get today's Wordle from server
     try:
-        async with httpx.AsyncClient(timeout=10) as http_client:
-            response = await http_client.post(
-                f"{SERVER_URL}/checkWordle",
-                json={'userId': user_id},
-                headers={"Content-Type": "application/json"}
-            )
-            response.raise_for_status()
-            data = response.json()
+        http_client = get_http_client()
+        response = await http_client.post(
+            f"{SERVER_URL}/checkWordle",
+            json={'userId': user_id},
+            headers={"Content-Type": "application/json"},
+            timeout=SERVER_HTTP_TIMEOUT
+        )
+        response.raise_for_status()
+        data = response.json()
             
-            if data.get('exists') and data['wordle']:
-                wordle = data['wordle']['wordle']
-                logger.info(f"🔍 Found existing Wordle: {wordle}")
-            else:
-                logger.info("🔍 No existing Wordle found")
-                return False
+        if data.get('exists') and data['wordle']:
+            wordle = data['wordle']['wordle']
+            logger.info(f"🔍 Found existing Wordle: {wordle}")
+        else:
+            logger.info("🔍 No existing Wordle found")
+            return False
     except httpx.TimeoutException:
         logger.error("⌛ Timeout while checking Wordle on server")
         return False
@@ -1102,23 +2803,27 @@ async def auto_wordle(client: TelegramClient, user_id: str) -> bool:
         return False
     
     # Send the Wordle answer
-    await client.send_message(BOT_USERNAME, wordle)
+    version = stream_version(client)
+    await tg_request(client, client.send_message, BOT_USERNAME, wordle)
     logger.info(f"📩 Sent Wordle: {wordle}")
-    await asyncio.sleep(6)  # Wait for response
     
-    # Check result
-    messages = await client.get_messages(BOT_USERNAME, limit=1)
-    if not messages:
+    # Wait for the verdict
+    msg = await wait_for_bot_update(
+        client, version, timeout=6,
+        predicate=lambda m: "You guessed the word" in (m.text or "") or "tries left" in (m.text or "")
+    )
+    if not msg:
+        msg = await get_latest_bot_message(client)
+    if not msg:
         logger.warning("No response after sending Wordle")
         return False
     
-    msg = messages[0]
     message_text = msg.text or ""
     
     # Handle success case
     if "🎉 You guessed the word!" in message_text:
         logger.info("🎉 Wordle solved successfully!")
-        await click(client, "🏠")
+        await navigate_to(client, "Home")
         
         # Extract the word from message
         word = None
@@ -1129,24 +2834,25 @@ async def auto_wordle(client: TelegramClient, user_id: str) -> bool:
         
         # Verify on server
         try:
-            async with httpx.AsyncClient(timeout=10) as http_client:
-                response = await http_client.post(
-                    f"{SERVER_URL}/saveWordle",
-                    json={
-                        'userId': user_id,
-                        'wordle': word,
-                        'status': 'Verified'
-                    },
-                    headers={"Content-Type": "application/json"}
-                )
-                response.raise_for_status()
-                data = response.json()
+            http_client = get_http_client()
+            response = await http_client.post(
+                f"{SERVER_URL}/saveWordle",
+                json={
+                    'userId': user_id,
+                    'wordle': word,
+                    'status': 'Verified'
+                },
+                headers={"Content-Type": "application/json"},
+                timeout=SERVER_HTTP_TIMEOUT
+            )
+            response.raise_for_status()
+            data = response.json()
                 
-                if data.get('success'):
-                    logger.info("✅ Successfully verified Wordle on server")
-                    return True
-                logger.error("🚫 Failed to verify Wordle on server")
-                return False
+            if data.get('success'):
+                logger.info("✅ Successfully verified Wordle on server")
+                return True
+            logger.error("🚫 Failed to verify Wordle on server")
+            return False
         except httpx.TimeoutException:
             logger.error("⌛ Timeout while verifying Wordle on server")
             return False
@@ -1157,28 +2863,29 @@ async def auto_wordle(client: TelegramClient, user_id: str) -> bool:
     # Handle wrong guess case
     elif "You have" in message_text and "tries left" in message_text:
         logger.info("❌ Wrong Wordle guess")
-        await click(client, "🏠")
+        await navigate_to(client, "Home")
         
         # Mark as wrong on server
         try:
-            async with httpx.AsyncClient(timeout=10) as http_client:
-                response = await http_client.post(
-                    f"{SERVER_URL}/saveWordle",
-                    json={
-                        'userId': user_id,
-                        'wordle': wordle,
-                        'status': 'Wrong'
-                    },
-                    headers={"Content-Type": "application/json"}
-                )
-                response.raise_for_status()
-                data = response.json()
+            http_client = get_http_client()
+            response = await http_client.post(
+                f"{SERVER_URL}/saveWordle",
+                json={
+                    'userId': user_id,
+                    'wordle': wordle,
+                    'status': 'Wrong'
+                },
+                headers={"Content-Type": "application/json"},
+                timeout=SERVER_HTTP_TIMEOUT
+            )
+            response.raise_for_status()
+            data = response.json()
                 
-                if data.get('success'):
-                    logger.info("✅ Successfully saved Wrong Wordle on server")
-                    return True
-                logger.error("🚫 Failed to save Wrong Wordle on server")
-                return False
+            if data.get('success'):
+                logger.info("✅ Successfully saved Wrong Wordle on server")
+                return True
+            logger.error("🚫 Failed to save Wrong Wordle on server")
+            return False
         except httpx.TimeoutException:
             logger.error("⌛ Timeout while saving Wrong Wordle on server")
             return False
@@ -1201,31 +2908,38 @@ async def get_current_status(client: TelegramClient) -> Tuple[Optional[str], Opt
     """Get current pet status for single client with robust error handling."""
     try:
         # Try to get the last message first
-        messages = await client.get_messages(BOT_USERNAME, limit=1)
-        if messages and messages[0].text:
-            msg_text = messages[0].text
-            if any(keyword in msg_text for keyword in STATUS_KEYWORDS):
-                return msg_text, messages[0].reply_markup
+        msg = await get_latest_bot_message(client)
+        if msg and msg.text:
+            if any(keyword in msg.text for keyword in STATUS_KEYWORDS):
+                return msg.text, msg.reply_markup
 
         # If no valid message found, request fresh status
-        async with client.conversation(BOT_USERNAME, timeout=15) as conv:
-            try:
-                await conv.send_message('/start')
-                response = await conv.get_response()
-                
-                # Verify we got a proper response
-                if response and response.text:
-                    return response.text, response.reply_markup
-                
-            except asyncio.TimeoutError:
-                logger.warning("Timeout waiting for bot response")
-            except Exception as conv_error:
-                logger.warning(f"Conversation error: {str(conv_error)}")
+        if client in message_streams:
+            version = stream_version(client)
+            await tg_request(client, client.send_message, BOT_USERNAME, '/start')
+            response = await wait_for_bot_update(client, version, timeout=15)
+            if response and response.text:
+                return response.text, response.reply_markup
+            logger.warning("Timeout waiting for bot response")
+        else:
+            async with client.conversation(BOT_USERNAME, timeout=15) as conv:
+                try:
+                    await conv.send_message('/start')
+                    response = await conv.get_response()
+                    
+                    # Verify we got a proper response
+                    if response and response.text:
+                        return response.text, response.reply_markup
+                    
+                except asyncio.TimeoutError:
+                    logger.warning("Timeout waiting for bot response")
+                except Exception as conv_error:
+                    logger.warning(f"Conversation error: {str(conv_error)}")
 
         # Final fallback attempt
-        messages = await client.get_messages(BOT_USERNAME, limit=1)
-        if messages and messages[0].text:
-            return messages[0].text, messages[0].reply_markup
+        msg = await get_latest_bot_message(client)
+        if msg and msg.text:
+            return msg.text, msg.reply_markup
 
     except Exception as e:
         logger.error(f"Status check failed: {str(e)}")
@@ -1242,122 +2956,369 @@ STATUS_KEYWORDS = [
     "You are in the", "Current room:"
 ]
 
+# ----------------------------
+# Global Tick Scheduler
+# ----------------------------
+TICK_RESOLUTION = 0.5  # seconds per wheel slot
+TICK_WHEEL_SLOTS = 512
+TICK_JITTER = float(os.getenv('TICK_JITTER', 0.15))          # ± fraction of each delay
+TICK_START_SPREAD = float(os.getenv('TICK_START_SPREAD', 30))  # seconds
+TICK_MAX_CONCURRENT = int(os.getenv('TICK_MAX_CONCURRENT', 20))
+
+class TickScheduler:
+    """Hashed timer wheel that owns every monitor's next tick.
+
+    One driver task advances the wheel; delays get ± TICK_JITTER so ticks
+    spread out, and slot() caps how many ticks run at once.
+    """
+
+    def __init__(self, resolution: float = TICK_RESOLUTION, slots: int = TICK_WHEEL_SLOTS,
+                 jitter: float = TICK_JITTER, max_concurrent: int = TICK_MAX_CONCURRENT):
+        self.resolution = resolution
+        self.slots = slots
+        self.jitter = jitter
+        self.max_concurrent = max_concurrent
+        self._reset(None)
+
+    def _reset(self, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        self.loop = loop
+        self.wheel: List[List[list]] = [[] for _ in range(self.slots)]
+        self.cursor = 0
+        self.scheduled = 0
+        self.running = 0
+        self.waiting_for_slot = 0
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._driver: Optional[asyncio.Task] = None
+
+    def _ensure_driver(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self._reset(loop)  # run_async_code may recreate the loop
+        if self._driver is None or self._driver.done():
+            self._driver = loop.create_task(self._drive())
+
+    async def _drive(self) -> None:
+        next_step = time.monotonic()
+        while True:
+            next_step += self.resolution
+            await asyncio.sleep(max(0.0, next_step - time.monotonic()))
+            self.cursor = (self.cursor + 1) % self.slots
+            bucket = self.wheel[self.cursor]
+            keep = []
+            for entry in bucket:
+                if entry[0] > 0:
+                    entry[0] -= 1  # fires on a later lap
+                    keep.append(entry)
+                elif not entry[1].done():
+                    entry[1].set_result(None)
+            self.wheel[self.cursor] = keep
+
+    async def wait(self, delay: float) -> None:
+        """Sleep until the tick due in ~delay seconds (with jitter)."""
+        self._ensure_driver()
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        ticks = max(1, round(delay / self.resolution))
+        laps, offset = divmod(ticks - 1, self.slots)
+        future = self.loop.create_future()
+        self.wheel[(self.cursor + 1 + offset) % self.slots].append([laps, future])
+        self.scheduled += 1
+        try:
+            await future
+        finally:
+            self.scheduled -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one of the TICK_MAX_CONCURRENT tick slots (status read and decision only)."""
+        self._ensure_driver()
+        self.waiting_for_slot += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting_for_slot -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "scheduled": self.scheduled,
+            "queue_depth": self.waiting_for_slot,
+            "running": self.running,
+            "max_concurrent": self.max_concurrent
+        }
+
+tick_scheduler = TickScheduler()
+
+# ----------------------------
+# Persistent Pet State
+# ----------------------------
+PET_STATE_DB = os.getenv('PET_STATE_DB', 'pet_state.db')
+
+class PetStateStore:
+    """Per-user pet state (chore timers, last stats/decision, inventory, error count)
+    kept in a local SQLite database in WAL mode so it survives restarts.
+
+    State is loaded lazily on first use per user and written through on update;
+    database calls run in a worker thread to keep them off the event loop.
+    """
+    DEFAULTS = {
+        "last_wordle_time": 0,
+        "last_door_time": 0,
+        "last_stats": None,
+        "last_decision": None,
+        "inventory": {},
+        "consecutive_errors": 0
+    }
+
+    def __init__(self, path: str = PET_STATE_DB):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+        self.cache: Dict[int, Dict[str, any]] = {}
+        self.metrics = defaultdict(int)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS pet_state ("
+                         "user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)")
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _read(self, user_id: int) -> Dict[str, any]:
+        with self.lock:
+            row = self._connection().execute(
+                "SELECT state FROM pet_state WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _write(self, user_id: int, state: str) -> None:
+        with self.lock:
+            conn = self._connection()
+            conn.execute("INSERT INTO pet_state (user_id, state, updated_at) VALUES (?, ?, ?) "
+                         "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                         (user_id, state, time.time()))
+            conn.commit()
+
+    async def load(self, user_id: int) -> Dict[str, any]:
+        """Return the user's state, reading it from disk on first access."""
+        state = self.cache.get(user_id)
+        if state is None:
+            stored = {}
+            try:
+                stored = await asyncio.to_thread(self._read, user_id)
+                self.metrics["loads"] += 1
+            except (sqlite3.Error, ValueError) as e:
+                self.metrics["errors"] += 1
+                logger.error(f"⚠️ Could not load pet state for {user_id}: {e}")
+            state = copy.deepcopy(self.DEFAULTS)
+            state.update(stored)
+            self.cache[user_id] = state
+        return state
+
+    def forget(self, user_id: int) -> None:
+        """Drop a user's cached state once their session stops (it stays on disk)."""
+        self.cache.pop(user_id, None)
+
+    async def update(self, user_id: int, **fields) -> None:
+        """Merge fields into the user's state and persist it."""
+        state = await self.load(user_id)
+        state.update(fields)
+        try:
+            await asyncio.to_thread(self._write, user_id, json.dumps(state))
+            self.metrics["writes"] += 1
+        except (sqlite3.Error, TypeError) as e:
+            self.metrics["errors"] += 1
+            logger.error(f"⚠️ Could not save pet state for {user_id}: {e}")
+
+pet_state_store = PetStateStore()
+
 # ----------------------------
 # AI-Enhanced Main Monitoring Function (Single User)
 # ----------------------------
 async def monitor_pet(session_string: str, client: TelegramClient) -> None:
     """AI-enhanced function to monitor and care for a single pet, with Wordle and Door automation."""
+    user_id = None
     try:
         await client.start()
         me = await client.get_me()
         user_id = me.id
+        start_telegram_scheduler(client, str(user_id))
+        await start_message_stream(client)
         logger.info(f"🐾 Pet monitoring session started for user {user_id}")
 
+        # Restore what previous sessions knew so restarts don't repeat chores or actions
+        state = await pet_state_store.load(user_id)
         start_time = time.time()
         max_duration = 180 * 60  # 3 hours runtime
-        consecutive_errors = 0
+        consecutive_errors = state['consecutive_errors']
+        last_stats: Optional[PetStats] = PetStats(**state['last_stats']) if state['last_stats'] else None
+        last_decision: Optional[Dict[str, any]] = state['last_decision']
+        trajectory = StatTrajectory()
+        inventory = inventories[client] = Inventory.from_dict(state['inventory'])
 
         # Initialize timers for Wordle and Door automation
-        last_wordle_time = 0
-        last_door_time = 0
+        last_wordle_time = state['last_wordle_time']
+        last_door_time = state['last_door_time']
         wordle_interval = 30 * 60  # 2 hours
         door_interval = 30 * 60    # 2 hours
 
-        while time.time() - start_time < max_duration:
-            try:
-                logger.info("\n🤖 AI Checking pet status...")
-                message, _ = await get_current_status(client)
-
-                if not message:
-                    logger.warning("No message received from bot")
-                    consecutive_errors += 1
-                    await log_pet_error(user_id, "No message received from bot")
-
-                    if consecutive_errors >= 3:
-                        logger.error("Too many consecutive errors, restarting client")
-                        await client.disconnect()
-                        await asyncio.sleep(5)
-                        await client.connect()
-                        consecutive_errors = 0
-                    await asyncio.sleep(30)
-                    continue
+        # Spread first ticks so sessions started together don't run in lockstep
+        next_delay = random.uniform(0, TICK_START_SPREAD)
 
-                consecutive_errors = 0
-                stats = extract_stats(message)
-                await save_pet_stats(user_id, stats)
-
-                logger.info(f"📊 Current Status:\nEnergy: {stats['energy']} | Clean: {stats['clean']}\n"
-                            f"Health: {stats['health']} | Hunger: {stats['hunger']}\n"
-                            f"Happiness: {stats['happiness']} | Sleeping: {stats['is_sleeping']}")
-
-                # AI decision for pet care
+        while time.time() - start_time < max_duration:
+            await tick_scheduler.wait(next_delay)
+            async with contextlib.AsyncExitStack() as tick:
+                await tick.enter_async_context(tick_scheduler.slot())
                 try:
-                    ai_decision = await asyncio.wait_for(
-                        get_ai_decision(stats, user_id),
-                        timeout=20
-                    )
-                except asyncio.TimeoutError:
-                    logger.warning("AI decision timeout, using default action")
-                    await log_pet_error(user_id, "AI decision timeout")
-                    ai_decision = {'action': 'wait', 'priority': 'medium'}
-
-                action_handlers = {
-                    'emergency': (emergency_care, "🚨 Emergency care"),
-                    'wake': (wake_pet, "☀️ Waking pet"),
-                    'play': (play_throw_ball_game, "🎮 Playing game"),
-                    'feed': (feed_pet, "🍽️ Feeding"),
-                    'bathe': (bathe_pet, "🛁 Bathing"),
-                    'sleep': (sleep_pet, "😴 Putting to sleep")
-                }
-
-                if ai_decision['action'] in action_handlers:
-                    handler, action_name = action_handlers[ai_decision['action']]
-                    logger.info(f"{action_name} | Reason: {ai_decision.get('reasoning', 'N/A')}")
-                    try:
-                        await handler(client)
-                    except Exception as e:
-                        logger.error(f"Action failed: {str(e)}")
-                        await log_pet_error(user_id, f"Action failed: {str(e)}")
-
-                # ----------------------------
-                # Automated Wordle (every 2 hours)
-                # ----------------------------
-                if time.time() - last_wordle_time > wordle_interval:
-                    logger.info("🎮 Running automated Wordle...")
-                    try:
-                        await auto_wordle(client, user_id)
-                        last_wordle_time = time.time()
-                    except Exception as e:
-                        logger.error(f"Wordle automation failed: {str(e)}")
-                        await log_pet_error(user_id, f"Wordle automation failed: {str(e)}")
-
-                # ----------------------------
-                # Automated Doors (every 2 hours)
-                # ----------------------------
-                if time.time() - last_door_time > door_interval:
-                    logger.info("🚪 Running automated Door sequence...")
-                    try:
-                        await auto_door(client, user_id)
-                        last_door_time = time.time()
-                    except Exception as e:
-                        logger.error(f"Door automation failed: {str(e)}")
-                        await log_pet_error(user_id, f"Door automation failed: {str(e)}")
-
-                # Adaptive sleep based on AI priority
-                sleep_time = 20 if ai_decision.get('priority') == 'high' else 30
-                logger.info(f"⏳ Next check in {sleep_time} seconds")
-                await asyncio.sleep(sleep_time)
+                    logger.info("\n🤖 AI Checking pet status...")
+                    message, _ = await get_current_status(client)
+
+                    if not message:
+                        logger.warning("No message received from bot")
+                        consecutive_errors += 1
+                        await tick.aclose()
+                        await log_pet_error(user_id, "No message received from bot")
+                        await pet_state_store.update(user_id, consecutive_errors=consecutive_errors)
+
+                        if consecutive_errors >= 3:
+                            logger.error("Too many consecutive errors, restarting client")
+                            await client.disconnect()
+                            await asyncio.sleep(5)
+                            await client.connect()
+                            consecutive_errors = 0
+                        next_delay = 30
+                        continue
+
+                    consecutive_errors = 0
+                    stats = extract_stats(message)
+                    changes = stats.diff(last_stats)
+
+                    if changes:
+                        await save_pet_stats(user_id, stats)
+                        logger.info(f"📊 Current Status:\nEnergy: {stats['energy']} | Clean: {stats['clean']}\n"
+                                    f"Health: {stats['health']} | Hunger: {stats['hunger']}\n"
+                                    f"Happiness: {stats['happiness']} | Sleeping: {stats['is_sleeping']}")
+                    else:
+                        logger.info("📊 Stats unchanged since last check")
+
+                    # Unchanged stats after a 'wait' can't lead to a different decision, unless
+                    # that wait was only a stand-in for a failed or timed-out AI call
+                    if (not changes and last_decision and last_decision['action'] == 'wait'
+                            and last_decision.get('source') not in (None, 'fallback')):
+                        ai_decision = last_decision
+                    else:
+                        # AI decision for pet care
+                        try:
+                            ai_decision = await asyncio.wait_for(
+                                get_ai_decision(stats, user_id),
+                                timeout=20
+                            )
+                        except asyncio.TimeoutError:
+                            logger.warning("AI decision timeout, using default action")
+                            await log_pet_error(user_id, "AI decision timeout")
+                            ai_decision = {'action': 'wait', 'priority': 'medium'}
+                    trajectory.observe(stats, acted=bool(last_decision) and last_decision['action'] != 'wait')
+                    if changes or ai_decision is not last_decision or state['consecutive_errors']:
+                        await pet_state_store.update(user_id, last_stats=stats.to_dict(),
+                                                     last_decision=ai_decision, consecutive_errors=0)
+                    last_stats, last_decision = stats, ai_decision
+
+                    # The tick slot only bounds concurrent status reads and decisions;
+                    # slow actions, mini-games and error reporting must not hold up other pets' ticks
+                    await tick.aclose()
+
+                    action_handlers = {
+                        'emergency': (emergency_care, "🚨 Emergency care"),
+                        'wake': (wake_pet, "☀️ Waking pet"),
+                        'play': (play_throw_ball_game, "🎮 Playing game"),
+                        'feed': (feed_pet, "🍽️ Feeding"),
+                        'bathe': (bathe_pet, "🛁 Bathing"),
+                        'sleep': (sleep_pet, "😴 Putting to sleep")
+                    }
+
+                    if ai_decision['action'] in action_handlers:
+                        handler, action_name = action_handlers[ai_decision['action']]
+                        logger.info(f"{action_name} | Reason: {ai_decision.get('reasoning', 'N/A')}")
+                        priority = PRIORITY_EMERGENCY if ai_decision['action'] == 'emergency' else PRIORITY_CARE
+                        action_started = time.perf_counter()
+                        try:
+                            with telegram_priority(priority):
+                                ok = await handler(client)
+                        except Exception as e:
+                            ok = False
+                            logger.error(f"Action failed: {str(e)}")
+                            await log_pet_error(user_id, f"Action failed: {str(e)}")
+                        decision_log.record("outcome", user_id=user_id, action=ai_decision['action'],
+                                            ok=ok is not False, seconds=round(time.perf_counter() - action_started, 3))
+
+                    # ----------------------------
+                    # Automated Wordle (every 2 hours)
+                    # ----------------------------
+                    if time.time() - last_wordle_time > wordle_interval:
+                        logger.info("🎮 Running automated Wordle...")
+                        try:
+                            with telegram_priority(PRIORITY_CHORE):
+                                await auto_wordle(client, user_id)
+                            last_wordle_time = time.time()
+                            inventory.invalidate()
+                            await pet_state_store.update(user_id, last_wordle_time=last_wordle_time)
+                        except Exception as e:
+                            logger.error(f"Wordle automation failed: {str(e)}")
+                            await log_pet_error(user_id, f"Wordle automation failed: {str(e)}")
+
+                    # ----------------------------
+                    # Automated Doors (every 2 hours)
+                    # ----------------------------
+                    if time.time() - last_door_time > door_interval:
+                        logger.info("🚪 Running automated Door sequence...")
+                        try:
+                            with telegram_priority(PRIORITY_CHORE):
+                                await auto_door(client, user_id)
+                            last_door_time = time.time()
+                            inventory.invalidate()
+                            await pet_state_store.update(user_id, last_door_time=last_door_time)
+                        except Exception as e:
+                            logger.error(f"Door automation failed: {str(e)}")
+                            await log_pet_error(user_id, f"Door automation failed: {str(e)}")
+
+                    if inventory.dirty:
+                        inventory.dirty = False
+                        await pet_state_store.update(user_id, inventory=inventory.to_dict())
+
+                    # Adaptive sleep based on AI priority
+                    sleep_time = 20 if ai_decision.get('priority') == 'high' else 30
+
+                    # Idle pet: sleep until just before a stat is predicted to need care,
+                    # but never past the next Wordle/Door run
+                    if ai_decision['action'] == 'wait':
+                        chores_due = min(last_wordle_time + wordle_interval, last_door_time + door_interval) - time.time()
+                        sleep_time = max(sleep_time, min(trajectory.next_check_in(stats, sleep_time), chores_due))
+                    logger.info(f"⏳ Next check in ~{sleep_time} seconds")
+                    next_delay = sleep_time
 
-            except Exception as e:
-                logger.error(f"Monitoring error: {str(e)}")
-                await log_pet_error(user_id, f"Monitoring error: {str(e)}")
-                await asyncio.sleep(min(60, 10 * (consecutive_errors + 1)))
-                consecutive_errors += 1
+                except Exception as e:
+                    logger.error(f"Monitoring error: {str(e)}")
+                    await tick.aclose()
+                    await log_pet_error(user_id, f"Monitoring error: {str(e)}")
+                    next_delay = min(60, 10 * (consecutive_errors + 1))
+                    consecutive_errors += 1
+                    await pet_state_store.update(user_id, consecutive_errors=consecutive_errors)
 
     except Exception as e:
         logger.error(f"💥 Critical monitoring failure: {str(e)}")
         await log_pet_error(user_id, f"Critical monitoring failure: {str(e)}")
     finally:
+        stop_message_stream(client)
+        stop_telegram_scheduler(client)
+        if user_id is not None:
+            pet_state_store.forget(user_id)
         await safe_client_disconnect(client)
         logger.info("🛑 Monitoring session ended")
 # ----------------------------
@@ -1381,70 +3342,356 @@ def start_flask_in_thread():
 # ----------------------------
 # Fetch sessions from server
 # ----------------------------
-def fetch_sessions_from_db():
-    try:
-        logger.info(f"🌐 Fetching sessions from DB")
-        resp = requests.get(SERVER_UR, timeout=10)
-        logger.debug(f"HTTP {resp.status_code} | Raw: {resp.text[:200]}")
+# Worker processes each keep their own router, decision cache and batcher;
+# only the global provider quotas are split between them (see worker_main)
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 1))
+MAX_SESSIONS_PER_WORKER = int(os.getenv('MAX_SESSIONS_PER_WORKER', 250))
+MAX_SESSIONS = MAX_SESSIONS_PER_WORKER * max(1, WORKER_COUNT)
+SESSION_REFRESH_INTERVAL = int(os.getenv('SESSION_REFRESH_INTERVAL', 300))  # seconds
+
+class SessionMirror:
+    """Local mirror of the /getinfo session table, synced incrementally.
+
+    Sends If-None-Match / If-Modified-Since and a `since` cursor. A 304 means
+    nothing changed; a JSON list is a full snapshot; a JSON object
+    {"sessions": [...], "removed": [...], "cursor": ...} is a delta. On errors
+    the mirror is kept, so a server hiccup never stops monitoring.
+    """
 
-        resp.raise_for_status()
+    def __init__(self):
+        self.sessions: Dict[int, str] = {}
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.cursor: Optional[str] = None
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    @staticmethod
+    def _parse_items(items) -> Dict[int, str]:
+        return {item["id"]: item["session"] for item in items if "session" in item and "id" in item}
+
+    async def sync(self) -> bool:
+        """Pull changes from the server; True if the mirror changed."""
+        params = {"since": self.cursor} if self.cursor else None
+        response = await get_http_client().get(
+            SERVER_UR, headers=self._headers(), params=params, timeout=SERVER_HTTP_TIMEOUT
+        )
+        if response.status_code == 304:
+            logger.info("✅ Sessions unchanged since last sync")
+            return False
+        response.raise_for_status()
+        data = response.json()
+
+        self.etag = response.headers.get("etag", self.etag)
+        self.last_modified = response.headers.get("last-modified", self.last_modified)
+
+        if isinstance(data, dict):
+            # Delta since our cursor
+            updated = self._parse_items(data.get("sessions", []))
+            removed = set(data.get("removed", []))
+            self.cursor = data.get("cursor", self.cursor)
+            new_sessions = {k: v for k, v in self.sessions.items() if k not in removed}
+            new_sessions.update(updated)
+        else:
+            # Server ignores cursors: full snapshot
+            new_sessions = self._parse_items(data)
+
+        added = new_sessions.keys() - self.sessions.keys()
+        removed = self.sessions.keys() - new_sessions.keys()
+        changed = {k for k in new_sessions.keys() & self.sessions.keys() if new_sessions[k] != self.sessions[k]}
+        self.sessions = new_sessions
+        logger.info(f"✅ Session sync: +{len(added)} -{len(removed)} ~{len(changed)} ({len(new_sessions)} total)")
+        return bool(added or removed or changed)
+
+session_mirror = SessionMirror()
+
+async def fetch_sessions_from_db() -> Optional[Dict[int, str]]:
+    """Sync the session mirror; returns the sessions to monitor, or None if unchanged."""
+    try:
+        logger.info(f"🌐 Syncing sessions from DB")
+        if not await session_mirror.sync():
+            return None
 
-        try:
-            data = resp.json()
-            logger.info(f"✅ Retrieved {len(data)} records from DB")
-        except ValueError:
-            logger.error(f"⚠️ Non-JSON response from server: {resp.text[:200]}")
-            return {}
-
-        sessions = {}
-        for item in data:
-            if "session" in item and "id" in item:
-                sessions[item["id"]] = item["session"]
-
-        limited = dict(list(sessions.items())[:10])  # max 10
+        limited = dict(list(session_mirror.sessions.items())[:MAX_SESSIONS])
         logger.info(f"📂 Prepared {len(limited)} sessions for monitoring")
         return limited
 
     except Exception as e:
         logger.error(f"❌ Failed to fetch sessions from DB: {str(e)}")
-        return {}
+        return None
 # ----------------------------
 # Manage monitoring pool
 # ----------------------------
+# Session string each active task was started with
+active_sessions: Dict[int, str] = {}
+
+def _stop_task(user_id: int) -> None:
+    active_tasks.pop(user_id).cancel()
+    active_sessions.pop(user_id, None)
+
+def sync_active_tasks(sessions: Dict[int, str]) -> None:
+    """Start/stop monitoring tasks so active_tasks matches sessions."""
+    # Stop tasks for users no longer in DB, or whose session changed
+    for user_id in list(active_tasks.keys()):
+        if user_id not in sessions:
+            logger.info(f"🛑 Stopping monitoring for user {user_id} (removed from DB)")
+            _stop_task(user_id)
+        elif sessions[user_id] != active_sessions.get(user_id):
+            logger.info(f"🔁 Session changed for user {user_id}, restarting monitoring")
+            _stop_task(user_id)
+
+    # Start tasks for new users, up to MAX_SESSIONS_PER_WORKER in this process
+    skipped = 0
+    for user_id, session in sessions.items():
+        if user_id not in active_tasks:
+            if len(active_tasks) >= MAX_SESSIONS_PER_WORKER:
+                skipped += 1
+                continue
+            try:
+                client = TelegramClient(StringSession(session), API_ID, API_HASH)
+                task = asyncio.create_task(monitor_pet(session, client))
+                active_tasks[user_id] = task
+                active_sessions[user_id] = session
+                logger.info(f"🐾 Started monitoring for new user {user_id}")
+            except Exception as e:
+                logger.error(f"💥 Failed to start session for user {user_id}: {str(e)}")
+
+    if skipped:
+        logger.warning(f"⚠️ At {MAX_SESSIONS_PER_WORKER} sessions, not monitoring {skipped} more users")
+
 async def manage_sessions():
     """Periodically refresh sessions from DB and sync monitoring tasks."""
-    global active_tasks
-
     while True:
         logger.info("🔄 Refreshing sessions from DB...")
-        sessions = fetch_sessions_from_db()
-
-        # Stop tasks for users no longer in DB
-        for user_id in list(active_tasks.keys()):
-            if user_id not in sessions:
-                logger.info(f"🛑 Stopping monitoring for user {user_id} (removed from DB)")
-                active_tasks[user_id].cancel()
-                del active_tasks[user_id]
-
-        # Start tasks for new users
-        for user_id, session in sessions.items():
-            if user_id not in active_tasks:
-                try:
-                    client = TelegramClient(StringSession(session), API_ID, API_HASH)
-                    task = asyncio.create_task(monitor_pet(session, client))
-                    active_tasks[user_id] = task
-                    logger.info(f"🐾 Started monitoring for new user {user_id}")
-                except Exception as e:
-                    logger.error(f"💥 Failed to start session for user {user_id}: {str(e)}")
+        sessions = await fetch_sessions_from_db()
+        if sessions is not None:
+            sync_active_tasks(sessions)
+        await asyncio.sleep(SESSION_REFRESH_INTERVAL)
 
-        # Keep max 10
-        if len(active_tasks) > 10:
-            logger.warning("⚠️ Too many tasks, trimming to 10 users")
-            for user_id in list(active_tasks.keys())[10:]:
-                active_tasks[user_id].cancel()
-                del active_tasks[user_id]
+# ----------------------------
+# Session Sharding (Multi-Process)
+# ----------------------------
+WORKER_REPORT_INTERVAL = 10
+WORKER_CHECK_INTERVAL = 5
+WORKER_MAX_RESTARTS = int(os.getenv('WORKER_MAX_RESTARTS', 5))
+
+class ConsistentHashRing:
+    """Maps user ids to workers; adding/removing a worker only moves its share."""
+
+    def __init__(self, replicas: int = 100):
+        self.replicas = replicas
+        self._hashes: List[int] = []
+        self._nodes: Dict[int, int] = {}
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+    def add(self, node: int) -> None:
+        for replica in range(self.replicas):
+            h = self._hash(f"{node}:{replica}")
+            bisect.insort(self._hashes, h)
+            self._nodes[h] = node
+
+    def remove(self, node: int) -> None:
+        for replica in range(self.replicas):
+            h = self._hash(f"{node}:{replica}")
+            self._hashes.remove(h)
+            del self._nodes[h]
+
+    def node_for(self, key) -> int:
+        h = self._hash(str(key))
+        index = bisect.bisect(self._hashes, h) % len(self._hashes)
+        return self._nodes[self._hashes[index]]
+
+    def nodes_for(self, key) -> Iterator[int]:
+        """Distinct nodes clockwise from the key's position, its own node first."""
+        start = bisect.bisect(self._hashes, self._hash(str(key)))
+        seen = set()
+        for i in range(len(self._hashes)):
+            node = self._nodes[self._hashes[(start + i) % len(self._hashes)]]
+            if node not in seen:
+                seen.add(node)
+                yield node
+
+async def worker_main(worker_id: int, inbox, status_queue) -> None:
+    """Worker process loop: apply session assignments and report load."""
+    loop = asyncio.get_running_loop()
+    # API keys are shared by all workers, so each gets its share of the global quotas
+    rate_limiter.share_global(WORKER_COUNT)
+    # One log file per worker: appends from several processes could interleave
+    for log in (decision_log, message_capture):
+        if log.path:
+            base, ext = os.path.splitext(log.path)
+            log.path = f"{base}.{worker_id}{ext}"
+    stats_flusher = asyncio.create_task(stats_buffer.run())
+    logger.info(f"👷 Worker {worker_id} started (pid {os.getpid()})")
+    try:
+        while True:
+            try:
+                sessions = await loop.run_in_executor(None, inbox.get, True, WORKER_REPORT_INTERVAL)
+                if sessions is None:
+                    break
+                sync_active_tasks(sessions)
+            except queue.Empty:
+                pass
+            status_queue.put((worker_id, {
+                "pid": os.getpid(),
+                "sessions": len(active_tasks),
+                "metrics": process_metrics(),
+                "reported_at": time.time()
+            }))
+    finally:
+        for task in active_tasks.values():
+            task.cancel()
+        stats_flusher.cancel()
+        await stats_buffer.flush()
+        await close_http_client()
+        decision_log.close()
+        message_capture.close()
+        logger.info(f"👷 Worker {worker_id} stopped")
+
+def run_worker(worker_id: int, inbox, status_queue) -> None:
+    """Entry point of a worker process."""
+    asyncio.run(worker_main(worker_id, inbox, status_queue))
+
+class ShardSupervisor:
+    """Shards sessions over worker processes with consistent hashing."""
+
+    def __init__(self, worker_count: int):
+        self.ctx = multiprocessing.get_context('spawn')
+        self.worker_count = worker_count
+        self.ring = ConsistentHashRing()
+        self.workers: Dict[int, Tuple[multiprocessing.Process, any]] = {}
+        self.assignments: Dict[int, Dict[int, str]] = {}
+        self.restarts = defaultdict(int)
+        self.loads: Dict[int, Dict[str, any]] = {}
+        self.status_queue = self.ctx.Queue()
+
+    def _spawn(self, worker_id: int) -> None:
+        inbox = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=run_worker, args=(worker_id, inbox, self.status_queue),
+            name=f"pet-worker-{worker_id}", daemon=True
+        )
+        process.start()
+        self.workers[worker_id] = (process, inbox)
+        self.assignments.pop(worker_id, None)  # force a full resend
+
+    def start(self) -> None:
+        for worker_id in range(self.worker_count):
+            self._spawn(worker_id)
+            self.ring.add(worker_id)
+        logger.info(f"👷 Started {self.worker_count} worker processes")
+
+    def check_workers(self) -> bool:
+        """Restart dead workers; drop ones that keep dying. True if anything changed."""
+        changed = False
+        for worker_id, (process, _) in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            changed = True
+            self.restarts[worker_id] += 1
+            self.loads.pop(worker_id, None)
+            if self.restarts[worker_id] <= WORKER_MAX_RESTARTS:
+                logger.warning(f"💥 Worker {worker_id} died (exit {process.exitcode}), restarting")
+                self._spawn(worker_id)
+            elif len(self.workers) > 1:
+                logger.error(f"💥 Worker {worker_id} keeps dying, rebalancing its sessions")
+                del self.workers[worker_id]
+                self.assignments.pop(worker_id, None)
+                self.ring.remove(worker_id)
+            else:
+                self._spawn(worker_id)  # never run without any worker
+        return changed
+
+    def distribute(self, sessions: Dict[int, str]) -> None:
+        """Send each worker its shard, skipping workers whose shard is unchanged.
+
+        A worker never gets more than MAX_SESSIONS_PER_WORKER: overflow goes to
+        the next worker clockwise on the ring that still has room.
+        """
+        shards = defaultdict(dict)
+        unplaced = 0
+        for user_id in sorted(sessions):
+            for worker_id in self.ring.nodes_for(user_id):
+                if len(shards[worker_id]) < MAX_SESSIONS_PER_WORKER:
+                    shards[worker_id][user_id] = sessions[user_id]
+                    break
+            else:
+                unplaced += 1
+        if unplaced:
+            logger.warning(f"⚠️ All {len(self.workers)} workers full, not monitoring {unplaced} users")
+
+        for worker_id, (_, inbox) in self.workers.items():
+            shard = shards.get(worker_id, {})
+            if self.assignments.get(worker_id) != shard:
+                inbox.put(shard)
+                self.assignments[worker_id] = shard
+                logger.info(f"📦 Worker {worker_id} assigned {len(shard)} sessions")
+
+    def drain_status(self) -> None:
+        while True:
+            try:
+                worker_id, load = self.status_queue.get_nowait()
+            except queue.Empty:
+                return
+            if worker_id in self.workers:
+                self.loads[worker_id] = load
+
+    def snapshot(self) -> Dict[int, Dict[str, any]]:
+        return {
+            worker_id: {
+                "alive": process.is_alive(),
+                "assigned": len(self.assignments.get(worker_id, {})),
+                "restarts": self.restarts[worker_id],
+                **self.loads.get(worker_id, {})
+            }
+            for worker_id, (process, _) in self.workers.items()
+        }
 
-        await asyncio.sleep(300)  # refresh every 5 minutes
+    def shutdown(self) -> None:
+        for process, inbox in self.workers.values():
+            inbox.put(None)
+        for process, _ in self.workers.values():
+            process.join(timeout=15)
+            if process.is_alive():
+                process.terminate()
+        logger.info("👷 All workers stopped")
+
+shard_supervisor: Optional[ShardSupervisor] = None
+
+async def supervise_shards() -> None:
+    """Refresh sessions from DB and keep them sharded over worker processes."""
+    global shard_supervisor
+
+    shard_supervisor = ShardSupervisor(WORKER_COUNT)
+    shard_supervisor.start()
+    sessions: Dict[int, str] = {}
+    last_refresh = 0.0
+    try:
+        while True:
+            membership_changed = shard_supervisor.check_workers()
+            if time.monotonic() - last_refresh >= SESSION_REFRESH_INTERVAL:
+                logger.info("🔄 Refreshing sessions from DB...")
+                refreshed = await fetch_sessions_from_db()
+                last_refresh = time.monotonic()
+                if refreshed is not None:
+                    sessions = refreshed
+                    shard_supervisor.distribute(sessions)
+            elif membership_changed:
+                shard_supervisor.distribute(sessions)
+            shard_supervisor.drain_status()
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+    finally:
+        shard_supervisor.shutdown()
+        shard_supervisor = None
 
 # ----------------------------
 # Main Runner
@@ -1452,8 +3699,21 @@ async def manage_sessions():
 async def main() -> None:
     start_flask_in_thread()
 
+    if WORKER_COUNT > 1:
+        await supervise_shards()
+        return
+
+    stats_flusher = asyncio.create_task(stats_buffer.run())
+
     # Start the session manager loop
-    await manage_sessions()
+    try:
+        await manage_sessions()
+    finally:
+        stats_flusher.cancel()
+        await stats_buffer.flush()
+        await close_http_client()
+        decision_log.close()
+        message_capture.close()
 
 def run_async_code():
     while True:
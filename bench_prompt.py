@@ -0,0 +1,94 @@
+"""Benchmark: compact decision prompt vs. the original full prompt.
+
+Offline it compares prompt size (tokens, with tiktoken if installed, else a
+~4 chars/token estimate) and build time. With --live it also sends both
+prompts to every configured provider and reports latency and how often the
+two modes pick the same action.
+
+Usage: python bench_prompt.py [iterations] [--live]
+"""
+import asyncio
+import importlib.util
+import statistics
+import sys
+import time
+import timeit
+from typing import Callable, Dict, List
+
+from Premium import (PROVIDER_CALLS, PetStats, build_prompt, close_http_client,
+                     is_provider_configured)
+
+# States that reach the AI (no decisive rule matches them)
+STATES = [
+    PetStats(energy=55, clean=35, health=70, hunger=45, happiness=50),
+    PetStats(energy=30, clean=60, health=40, hunger=35, happiness=45),
+    PetStats(energy=65, clean=80, health=60, hunger=55, happiness=30),
+    PetStats(energy=52, clean=50, health=55, hunger=70, happiness=65, is_sleeping=True),
+    PetStats(energy=45, clean=25, health=50, hunger=40, happiness=60),
+    PetStats(energy=70, clean=45, health=35, hunger=60, happiness=55),
+]
+
+MODES = ("full", "compact")
+LIVE_ROUNDS = 3
+
+def token_counter() -> Callable[[str], int]:
+    if importlib.util.find_spec("tiktoken"):
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text))
+    return lambda text: max(1, len(text) // 4)
+
+def prompt_tokens(mode: str, count: Callable[[str], int]) -> float:
+    return statistics.mean(sum(count(part) for part in build_prompt(stats, mode)) for stats in STATES)
+
+async def live(rounds: int) -> None:
+    providers = [name for name in PROVIDER_CALLS if is_provider_configured(name)]
+    if not providers:
+        print("no providers configured, skipping live run")
+        return
+    for provider in providers:
+        latencies: Dict[str, List[float]] = {mode: [] for mode in MODES}
+        agree = total = 0
+        for _ in range(rounds):
+            for stats in STATES:
+                actions = {}
+                for mode in MODES:
+                    start = time.perf_counter()
+                    try:
+                        decision = await PROVIDER_CALLS[provider](build_prompt(stats, mode), 0)
+                    except Exception as e:
+                        print(f"{provider}/{mode}: {e}")
+                        continue
+                    latencies[mode].append(time.perf_counter() - start)
+                    actions[mode] = decision and decision.get("action")
+                if len(actions) == len(MODES):
+                    total += 1
+                    agree += len(set(actions.values())) == 1
+        for mode in MODES:
+            if latencies[mode]:
+                print(f"{provider:<12}{mode:<9}: median {statistics.median(latencies[mode]) * 1000:.0f} ms "
+                      f"over {len(latencies[mode])} calls")
+        if total:
+            print(f"{provider:<12}agreement: {agree}/{total} same action")
+    await close_http_client()
+
+def main() -> None:
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    iterations = int(args[0]) if args else 20000
+    count = token_counter()
+
+    tokens = {mode: prompt_tokens(mode, count) for mode in MODES}
+    build = {mode: timeit.timeit(lambda: [build_prompt(s, mode) for s in STATES], number=iterations)
+             for mode in MODES}
+    per_prompt = len(STATES) * iterations
+
+    for mode in MODES:
+        print(f"{mode:<8}: {tokens[mode]:.0f} input tokens, {build[mode] / per_prompt * 1e6:.2f} µs to build")
+    print(f"token reduction : {1 - tokens['compact'] / tokens['full']:.0%}")
+
+    if "--live" in sys.argv:
+        asyncio.run(live(LIVE_ROUNDS))
+
+
+if __name__ == '__main__':
+    main()
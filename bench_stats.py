@@ -0,0 +1,160 @@
+"""Micro-benchmark: precompiled single-pass extract_stats vs. the previous
+multi-regex implementation, over recorded bot messages.
+
+Record messages by running the bot with BOT_MESSAGE_CAPTURE_PATH set (one
+file per worker when sharded). Without capture files a small hand-written
+SAMPLE is used, which only checks that both parsers agree.
+
+Each run times both parsers back to back; the speedup is reported as the
+min / median / max over RUNS runs, since single runs are noisy.
+
+Usage: python bench_stats.py [CAPTURE.jsonl ...] [--iterations N] [--runs N]
+"""
+import argparse
+import json
+import re
+import statistics
+import timeit
+from typing import Dict, List
+
+from Premium import extract_stats
+
+RUNS = 15
+
+SAMPLE = [
+    # Home status (labelled, bold values)
+    "🏠 **PettBro's Home**\n\n"
+    "🍗 | Hunger: **64**\n❤️ | Health: **88**\n🔋 | Energy: **47**\n"
+    "🙂 | Happiness: **72**\n🧼 | Clean: **35**\n\nWhat would you like to do?",
+    # Compact status (plain bold values)
+    "🍗 **12** ❤️ **23** 🔋 **8** 🙂 **40** 🧼 **90**",
+    # Bedroom while sleeping
+    "🛌** You are in the Bedroom!** 🛌\n🌃 It's time for a nap!\nPettBro is sleeping 😴\n\n"
+    "🍗 | Hunger: **55**\n❤️ | Health: **70**\n🔋 | Energy: **15**\n"
+    "🙂 | Happiness: **60**\n🧼 | Clean: **80**",
+    # Bathroom
+    "🚽** You are in the Bathroom!** 🚽\n🛁 Bath time!\n\n🧼 | Clean: **20**\n🙂 | Happiness: **50**",
+    # Kitchen
+    "🍽** You're in the Kitchen!** 🍽\n🍳 Scroll to find the desired food!\n\n"
+    "🍗 | Hunger: **30**\n❤️ | Health: **45**",
+    # Game room
+    "🕹️** Welcome to the Game Room!** 🕹️\n🎮 Ready for a game time?\n\n"
+    "🔋 | Energy: **66**\n🙂 | Happiness: **33**",
+    # Non-status chatter
+    "🎉 You guessed the word!\nThe word was: CRANE",
+    "You have 3 tries left",
+    "",
+]
+
+def legacy_extract_stats(message: str) -> Dict[str, int]:
+    """Extract pet stats from Telegram messages (handles bold formatting)."""
+    stats = {
+        'energy': 0,
+        'clean': 0,
+        'health': 0,
+        'hunger': 0,
+        'happiness': 0,
+        'is_sleeping': False,
+        'in_bedroom': False,
+        'current_room': None
+    }
+
+    if not message:
+        return stats
+
+    # Detect current room
+    room_identifiers = {
+        "Bedroom": ["🛌** You are in the Bedroom!**", "It's time for a nap!"],
+        "Bathroom": ["🚽** You are in the Bathroom!**", "🛁 Bath time!"],
+        "Kitchen": ["🍽** You're in the Kitchen!**", "🍳 Scroll to find the desired food!"],
+        "Games": ["🕹️** Welcome to the Game Room!**", "🎮 Ready for a game time?"]
+    }
+
+    for room_name, phrases in room_identifiers.items():
+        if any(phrase in message for phrase in phrases):
+            stats['current_room'] = room_name
+            break
+
+    # Detect sleep status
+    stats['is_sleeping'] = any(
+        phrase in message 
+        for phrase in ["PettBro is sleeping 😴", "It's time for a nap!", "🌃 It's time for a nap!"]
+    )
+    stats['in_bedroom'] = stats['current_room'] == "Bedroom"
+
+    # Extract stats patterns
+    stat_patterns = [
+        (r'🍗\s*\|\s*Hunger:\s*\*\*(\d+)\*\*', 'hunger'),
+        (r'❤️\s*\|\s*Health:\s*\*\*(\d+)\*\*', 'health'),
+        (r'🔋\s*\|\s*Energy:\s*\*\*(\d+)\*\*', 'energy'),
+        (r'🙂\s*\|\s*Happiness:\s*\*\*(\d+)\*\*', 'happiness'),
+        (r'🧼\s*\|\s*Clean:\s*\*\*(\d+)\*\*', 'clean'),
+        (r'🍗\s*\*\*(\d+)\*\*', 'hunger'),
+        (r'❤️\s*\*\*(\d+)\*\*', 'health'),
+        (r'🔋\s*\*\*(\d+)\*\*', 'energy'),
+        (r'🙂\s*\*\*(\d+)\*\*', 'happiness'),
+        (r'🧼\s*\*\*(\d+)\*\*', 'clean')
+    ]
+
+    for pattern, stat_key in stat_patterns:
+        match = re.search(pattern, message)
+        if match:
+            try:
+                stats[stat_key] = int(match.group(1))
+            except (ValueError, IndexError):
+                continue
+
+    return stats
+
+
+def load_messages(paths: List[str]) -> List[str]:
+    messages = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("kind") == "message":
+                    messages.append(record.get("text") or "")
+    return messages
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark extract_stats against the legacy parser.")
+    parser.add_argument("captures", nargs="*", help="BOT_MESSAGE_CAPTURE_PATH files")
+    parser.add_argument("--iterations", type=int, help="passes over the corpus per run")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    args = parser.parse_args()
+
+    corpus = load_messages(args.captures) if args.captures else SAMPLE
+    if not corpus:
+        raise SystemExit("No recorded messages found")
+    if not args.captures:
+        print("no capture files given, using the built-in SAMPLE (not representative)")
+    # Roughly 200k messages per run unless told otherwise
+    iterations = args.iterations or max(1, 200000 // len(corpus))
+
+    for message in corpus:
+        new, old = extract_stats(message), legacy_extract_stats(message)
+        assert new == old, f"Parser mismatch:\n{message!r}\nnew={new}\nold={old}"
+
+    def time_parser(parse) -> float:
+        return timeit.timeit(lambda: [parse(m) for m in corpus], number=iterations)
+
+    legacy, current = [], []
+    for _ in range(args.runs):
+        legacy.append(time_parser(legacy_extract_stats))
+        current.append(time_parser(extract_stats))
+    speedups = sorted(old / new for old, new in zip(legacy, current))
+    per_run = len(corpus) * iterations
+
+    print(f"messages        : {len(corpus)} ({len(set(corpus))} distinct), {per_run} parsed per run")
+    print(f"legacy          : {statistics.median(legacy) / per_run * 1e6:.2f} µs/message (median)")
+    print(f"single-pass     : {statistics.median(current) / per_run * 1e6:.2f} µs/message (median)")
+    print(f"speedup         : median {statistics.median(speedups):.2f}x, "
+          f"min {speedups[0]:.2f}x, max {speedups[-1]:.2f}x over {args.runs} runs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Replay recorded decisions offline to benchmark and regression-test engines.
+
+Reads "decision" records from decision logs (DECISION_LOG_PATH, one
+decisions.<worker>.jsonl per worker process when sharded, and their rotated
+.1 ... .N files), rebuilds each extract_stats output and runs it through an engine:
+
+  ai        get_ai_decision (rules, cache, providers) against a local stub
+            provider that answers after --stub-latency ms
+  fallback  get_fallback_decision only
+
+Reports throughput, latency percentiles, where decisions came from and how
+often the replayed action matches the recorded one.
+
+Usage: python replay_decisions.py LOG.jsonl [LOG.jsonl ...] [--engine ai|fallback]
+           [--stub-latency MS] [--concurrency N] [--min-agreement FRACTION]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import Premium
+from Premium import PetStats, get_fallback_decision
+
+Record = Tuple[PetStats, Dict[str, any]]  # stats, recorded decision
+
+def load_records(paths: List[str]) -> List[Record]:
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if record.get("kind", "decision") == "decision":
+                        records.append((PetStats(**record["stats"]), record["decision"]))
+                except (ValueError, KeyError, TypeError):
+                    continue
+    return records
+
+def use_stub_provider(latency: float) -> None:
+    """Route every AI call to an in-process stub that answers like the fallback rules."""
+    async def stub(prompt: Premium.AIPrompt, user_id: int) -> Dict[str, any]:
+        await asyncio.sleep(latency)
+        payload = json.loads(prompt[1])
+
+        def answer(pet: Dict[str, any]) -> Dict[str, any]:
+            stats = PetStats(**{k: pet[k] for k in ("energy", "clean", "health", "hunger", "happiness")},
+                             is_sleeping=pet["sleeping"])
+            return Premium.match_rules(stats, Premium.FALLBACK_RULES) or {
+                "action": "wait", "reasoning": "All stats acceptable", "priority": "low"}
+
+        if isinstance(payload, list):
+            return {"decisions": [dict(answer(pet), id=pet["id"]) for pet in payload]}
+        return answer(payload)
+
+    Premium.AI_PROMPT_MODE = "compact"
+    Premium.PROVIDER_CALLS = {"stub": stub}
+    Premium.provider_router = Premium.ProviderRouter(["stub"])
+    Premium.decision_log.path = None  # don't append the replay to the live log
+
+async def replay(records: List[Record], engine: str, concurrency: int):
+    latencies: List[float] = []
+    sources: Counter = Counter()
+    agree = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, stats: PetStats, recorded: Dict[str, any]) -> None:
+        nonlocal agree
+        async with semaphore:
+            started = time.perf_counter()
+            if engine == "ai":
+                source, decision = await Premium._decide(stats, index)
+            else:
+                source, decision = "fallback", get_fallback_decision(stats)
+            latencies.append(time.perf_counter() - started)
+            sources[source] += 1
+            agree += decision["action"] == recorded.get("action")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(i, stats, recorded) for i, (stats, recorded) in enumerate(records)))
+    return time.perf_counter() - started, latencies, sources, agree
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay logged decisions through a decision engine.")
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--engine", choices=("ai", "fallback"), default="ai")
+    parser.add_argument("--stub-latency", type=float, default=50, help="stub provider latency in ms")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--min-agreement", type=float, help="exit non-zero below this agreement")
+    args = parser.parse_args()
+
+    records = load_records(args.logs)
+    if not records:
+        raise SystemExit("No decision records found")
+    use_stub_provider(args.stub_latency / 1000)
+
+    elapsed, latencies, sources, agree = asyncio.run(replay(records, args.engine, args.concurrency))
+    latencies.sort()
+    agreement = agree / len(records)
+
+    print(f"decisions   : {len(records)} in {elapsed:.2f}s ({len(records) / elapsed:.0f}/s)")
+    print(f"latency     : p50 {statistics.median(latencies) * 1000:.2f} ms, "
+          f"p95 {latencies[int(0.95 * (len(latencies) - 1))] * 1000:.2f} ms")
+    print(f"sources     : {', '.join(f'{k}={v}' for k, v in sources.most_common())}")
+    print(f"agreement   : {agreement:.1%} same action as recorded")
+
+    if args.min_agreement is not None and agreement < args.min_agreement:
+        raise SystemExit(f"Agreement {agreement:.1%} below {args.min_agreement:.1%}")
+
+
+if __name__ == '__main__':
+    main()
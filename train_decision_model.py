@@ -0,0 +1,132 @@
+"""Train the local decision model (a small decision tree) from decision logs.
+
+Each log line is a JSON object with the pet's "stats" (as extract_stats
+returns them), the "decision" taken and its "source" ("ai:<provider>",
+"rules", "cache" or "fallback"). Only remote provider answers are learned
+from unless --all is given; the local model's own answers ("ai:local")
+are always skipped. The tree is written as JSON to LOCAL_MODEL_PATH
+(or --out), where the running bot picks it up without a restart.
+
+Usage: python train_decision_model.py LOG.jsonl [LOG.jsonl ...] [--out PATH] [--all]
+                                       [--max-depth N] [--min-leaf N]
+"""
+import argparse
+import json
+import os
+import random
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from Premium import AI_ACTIONS, LOCAL_MODEL_PATH, PetStats, _stats_payload
+
+FEATURES = ("energy", "clean", "health", "hunger", "happiness", "sleeping")
+
+Sample = Tuple[Dict[str, float], str, str]  # features, action, priority
+
+def load_samples(paths: List[str], include_all: bool) -> List[Sample]:
+    samples = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    stats, decision = record["stats"], record["decision"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                source = str(record.get("source", ""))
+                if source == "ai:local":
+                    continue  # never learn from the model's own answers
+                if not include_all and not source.startswith("ai:"):
+                    continue
+                if decision.get("action") not in AI_ACTIONS:
+                    continue
+                features = {k: float(v) for k, v in _stats_payload(PetStats(**stats)).items()}
+                samples.append((features, decision["action"], decision.get("priority", "medium")))
+    return samples
+
+def gini(counts: Counter, total: int) -> float:
+    return 1.0 - sum((n / total) ** 2 for n in counts.values())
+
+def leaf(samples: List[Sample]) -> Dict[str, any]:
+    actions = Counter(s[1] for s in samples)
+    action, count = actions.most_common(1)[0]
+    priority = Counter(s[2] for s in samples if s[1] == action).most_common(1)[0][0]
+    return {"action": action, "priority": priority,
+            "confidence": round(count / len(samples), 4), "samples": len(samples)}
+
+def best_split(samples: List[Sample], min_leaf: int):
+    """(gain, feature, threshold) of the best gini split, or None."""
+    total = len(samples)
+    parent = gini(Counter(s[1] for s in samples), total)
+    best = None
+    for feature in FEATURES:
+        ordered = sorted(samples, key=lambda s: s[0][feature])
+        left, right = Counter(), Counter(s[1] for s in ordered)
+        for i in range(1, total):
+            action = ordered[i - 1][1]
+            left[action] += 1
+            right[action] -= 1
+            low, high = ordered[i - 1][0][feature], ordered[i][0][feature]
+            if low == high or i < min_leaf or total - i < min_leaf:
+                continue
+            impurity = (i * gini(left, i) + (total - i) * gini(+right, total - i)) / total
+            gain = parent - impurity
+            if gain > 1e-9 and (best is None or gain > best[0]):
+                best = (gain, feature, (low + high) / 2)
+    return best
+
+def build_tree(samples: List[Sample], depth: int, max_depth: int, min_leaf: int) -> Dict[str, any]:
+    if depth >= max_depth or len({s[1] for s in samples}) == 1:
+        return leaf(samples)
+    split = best_split(samples, min_leaf)
+    if split is None:
+        return leaf(samples)
+    _, feature, threshold = split
+    left = [s for s in samples if s[0][feature] <= threshold]
+    right = [s for s in samples if s[0][feature] > threshold]
+    return {
+        "feature": feature,
+        "threshold": threshold,
+        "left": build_tree(left, depth + 1, max_depth, min_leaf),
+        "right": build_tree(right, depth + 1, max_depth, min_leaf)
+    }
+
+def predict(tree: Dict[str, any], features: Dict[str, float]) -> Dict[str, any]:
+    node = tree
+    while "action" not in node:
+        node = node["left"] if features[node["feature"]] <= node["threshold"] else node["right"]
+    return node
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the local decision model from decision logs.")
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--out", default=LOCAL_MODEL_PATH)
+    parser.add_argument("--all", action="store_true", help="also learn from rules/cache/fallback decisions")
+    parser.add_argument("--max-depth", type=int, default=6)
+    parser.add_argument("--min-leaf", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = load_samples(args.logs, args.all)
+    if len(samples) < 2 * args.min_leaf:
+        raise SystemExit(f"Only {len(samples)} usable decisions logged; need at least {2 * args.min_leaf}")
+
+    # Hold out 20% to report how well the tree generalises
+    random.Random(0).shuffle(samples)
+    cut = max(1, len(samples) // 5)
+    holdout, train = samples[:cut], samples[cut:]
+    tree = build_tree(train, 0, args.max_depth, args.min_leaf)
+    correct = sum(predict(tree, s[0])["action"] == s[1] for s in holdout)
+    print(f"trained on {len(train)} decisions, holdout accuracy {correct / len(holdout):.1%} ({len(holdout)} held out)")
+
+    # Final model uses everything
+    tree = build_tree(samples, 0, args.max_depth, args.min_leaf)
+    # Replace atomically: the bot reloads the file as soon as its mtime changes
+    tmp = f"{args.out}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"features": FEATURES, "trained_on": len(samples), "tree": tree}, f)
+    os.replace(tmp, args.out)
+    print(f"model written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()